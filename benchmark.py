@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from gate_stream import BASES
+from sweep import build_toffoli
+from template_cache import clear_template_cache
+
+
+# SmallQulin sizes, Qulin sizes and the large-n scaling points run by default.
+DEFAULT_NS = list(range(8, 23)) + list(range(23, 41)) + [64, 128, 256, 512, 1024]
+
+# The metrics compared against a baseline and their default relative thresholds: gate metrics may not grow
+# at all, times and memory may grow by the given fraction. Times below MIN_TIME seconds are not compared.
+THRESHOLDS = {'cx': 0.0, 'total': 0.0, 'depth': 0.0, 'build_time': 0.25, 'transpile_time': 0.25,
+              'peak_memory': 0.10}
+MIN_TIME = 0.05
+
+
+def _min_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        clear_template_cache()
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _circuit_metrics(qc):
+    counts = qc.count_ops()
+    return {'cx': counts.get('cx', 0), 'total': sum(counts.values()), 'depth': qc.depth()}
+
+
+# This function benchmarks the n-qubit Toffoli of main.py. It measures the best of repeat cold builds
+# (template cache cleared) lowered into basis, the peak memory of one more traced build, the CX, total and
+# depth, and, with transpile_circuit=True, the old path of transpiling the unlowered circuit into basis.
+# With compare_qiskit=True it also transpiles Qiskit's own MCXGate(n - 1) on the same n qubits.
+def benchmark_point(n, basis='ibm', repeat=3, transpile_circuit=True, compare_qiskit=False):
+    point = {'n': n, 'variant': 'smallqulin' if n <= 22 else 'qulin'}
+
+    point['build_time'], gates = _min_time(lambda: build_toffoli(n, basis=basis), repeat)
+    point['cx'] = gates.count_ops().get('cx', 0)
+    point['total'] = len(gates)
+    point['depth'] = gates.depth()
+    del gates
+
+    clear_template_cache()
+    tracemalloc.start()
+    build_toffoli(n, basis=basis)
+    point['peak_memory'] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    if transpile_circuit or compare_qiskit:
+        from qiskit import QuantumCircuit, transpile
+
+    if transpile_circuit:
+        qc = build_toffoli(n, basis='none').to_circuit()
+        if BASES[basis] is None:
+            point['transpile_time'] = 0.0
+        else:
+            point['transpile_time'], _ = _min_time(
+                lambda: transpile(qc, basis_gates=list(BASES[basis]), optimization_level=0), repeat)
+
+    if compare_qiskit:
+        from qiskit.circuit.library import MCXGate
+
+        qc = QuantumCircuit(n)
+        qc.append(MCXGate(n - 1), list(range(n)))
+        basis_gates = list(BASES[basis] or ('h', 'x', 'cx', 'ccx', 'ry', 'u1', 'p', 'u'))
+        point['qiskit_time'], qiskit_qc = _min_time(
+            lambda: transpile(qc, basis_gates=basis_gates, optimization_level=0), repeat)
+        point.update({'qiskit_' + key: value for key, value in _circuit_metrics(qiskit_qc).items()})
+
+    return point
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+# This function runs benchmark_point for every n and returns one record with the environment.
+def run_benchmark(n_values, basis='ibm', repeat=3, transpile_circuit=True, compare_qiskit=False, verbose=True):
+    record = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': _git_commit(), 'basis': basis,
+              'python': platform.python_version(), 'machine': platform.machine(), 'points': []}
+    try:
+        import qiskit
+        record['qiskit'] = qiskit.__version__
+    except ImportError:
+        pass
+
+    for n in n_values:
+        point = benchmark_point(n, basis=basis, repeat=repeat, transpile_circuit=transpile_circuit,
+                                compare_qiskit=compare_qiskit)
+        record['points'].append(point)
+        if verbose:
+            print(format_point(point))
+    return record
+
+
+def format_point(point):
+    line = '%5d %-10s cx %7d total %8d depth %7d build %8.4fs mem %7.1f MB' % (
+        point['n'], point['variant'], point['cx'], point['total'], point['depth'], point['build_time'],
+        point['peak_memory'] / 1e6)
+    if 'transpile_time' in point:
+        line += ' transpile %8.4fs' % point['transpile_time']
+    if 'qiskit_cx' in point:
+        line += ' | qiskit cx %7d total %8d depth %7d in %8.4fs' % (
+            point['qiskit_cx'], point['qiskit_total'], point['qiskit_depth'], point['qiskit_time'])
+    return line
+
+
+# This function appends a record to a JSON history file holding a list of records.
+def append_history(path, record):
+    history = []
+    if os.path.exists(path):
+        with open(path) as file:
+            history = json.load(file)
+    history.append(record)
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as file:
+        json.dump(history, file, indent=1)
+    os.replace(temporary_path, path)
+
+
+# This function returns the regressions of record against baseline, for every n both contain,
+# as (n, metric, baseline value, new value) tuples.
+def compare_records(record, baseline, thresholds=None):
+    thresholds = dict(THRESHOLDS, **(thresholds or {}))
+    baseline_points = {point['n']: point for point in baseline['points']}
+    regressions = []
+    for point in record['points']:
+        old_point = baseline_points.get(point['n'])
+        if old_point is None:
+            continue
+        for metric, threshold in thresholds.items():
+            if metric not in point or metric not in old_point:
+                continue
+            old, new = old_point[metric], point[metric]
+            if metric.endswith('_time') and new < MIN_TIME:
+                continue
+            if new > old * (1 + threshold):
+                regressions.append((point['n'], metric, old, new))
+    return regressions
+
+
+def _load_record(path):
+    with open(path) as file:
+        record = json.load(file)
+    return record[-1] if isinstance(record, list) else record
+
+
+def _parse_thresholds(values):
+    thresholds = {}
+    for value in values:
+        metric, _, threshold = value.partition('=')
+        if metric not in THRESHOLDS:
+            raise SystemExit('unknown metric %r, expected one of %s' % (metric, ', '.join(THRESHOLDS)))
+        thresholds[metric] = float(threshold)
+    return thresholds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the Qulin compilation and catch regressions.')
+    parser.add_argument('n', type=int, nargs='*', help='the n to run (default: 8-40 and 64-1024)')
+    parser.add_argument('--basis', choices=list(BASES), default='ibm')
+    parser.add_argument('--repeat', type=int, default=3, help='report the best of this many timed runs')
+    parser.add_argument('--no-transpile', action='store_true', help='skip timing transpile() of the circuit')
+    parser.add_argument('--qiskit', action='store_true', help="also synthesize Qiskit's MCXGate side by side")
+    parser.add_argument('--history', default='benchmark_history.json', help='JSON file the run is appended to')
+    parser.add_argument('--no-history', action='store_true')
+    parser.add_argument('--save-baseline', default=None, help='also write the run to this baseline file')
+    parser.add_argument('--baseline', default=None, help='compare against this baseline (or history) file')
+    parser.add_argument('--threshold', action='append', default=[], metavar='METRIC=FRACTION',
+                        help='override a relative threshold, e.g. build_time=0.5')
+    args = parser.parse_args()
+
+    record = run_benchmark(args.n or DEFAULT_NS, basis=args.basis, repeat=args.repeat,
+                           transpile_circuit=not args.no_transpile, compare_qiskit=args.qiskit)
+    if not args.no_history:
+        append_history(args.history, record)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(record, file, indent=1)
+
+    if args.baseline:
+        regressions = compare_records(record, _load_record(args.baseline), _parse_thresholds(args.threshold))
+        for n, metric, old, new in regressions:
+            print('REGRESSION n=%d %s: %.6g -> %.6g' % (n, metric, old, new))
+        if regressions:
+            sys.exit(1)
+        print('no regressions against %s' % args.baseline)
@@ -0,0 +1,221 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import gate_stream
+import n_toffoli_decomp_utils
+import sweep
+import template_cache
+from gate_stream import GateStream, BASES
+from sweep import VARIANTS, build_toffoli
+
+
+# The version of the layout of an entry on disk, part of every key.
+STORE_FORMAT = 2
+
+# The modules whose source decides the gates of a build: any change to them gives new keys.
+CODE_MODULES = (gate_stream, n_toffoli_decomp_utils, template_cache, sweep)
+
+DEFAULT_MAX_BYTES = 4 << 30
+
+# The age in seconds after which a temporary directory is taken as left by a writer that was killed.
+STALE_SECONDS = 3600
+
+_ARRAYS = ('ops', 'qubits', 'params')
+_code_version = None
+
+
+# This function returns the hash of the source of CODE_MODULES, computed once per process.
+def code_version():
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256()
+        for module in CODE_MODULES:
+            with open(module.__file__, 'rb') as file:
+                digest.update(file.read())
+        _code_version = digest.hexdigest()[:16]
+    return _code_version
+
+
+# This function returns the default store directory: $QULIN_STORE, or qulin under the user's cache directory.
+def default_store_dir():
+    return os.environ.get('QULIN_STORE') or os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'qulin')
+
+
+# This class is a content-addressed directory of compiled circuits. Every build (n, variant, basis, error
+# budget, U_{+1} policy and the code version) is one subdirectory named by the hash of its parameters, holding
+# the gate arrays of its GateStream as ops.npy, qubits.npy and params.npy and the rest in meta.json.
+# Loading memory-maps the arrays, so opening a circuit costs the same for 10 and for 10^6 gates.
+# Writers build an entry in a temporary directory and rename it into place, which is atomic: concurrent
+# writers of the same entry (other processes or machines sharing the directory) never leave a partial entry,
+# the first rename wins and the others are discarded. When the store grows beyond max_bytes the least
+# recently used entries are removed, again by renaming them away first, so readers never see half an entry.
+# Eviction also removes the temporary directories of writers killed before their rename.
+class CircuitStore:
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = default_store_dir() if path is None else path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    # This function returns the key of a build, the name of its entry.
+    def key(self, n, variant='combined', basis='ibm', error_budget=0.0, depth_vs_cx='cx'):
+        parameters = {'format': STORE_FORMAT, 'code': code_version(), 'n': n, 'variant': variant, 'basis': basis,
+                      'error_budget': float(error_budget), 'depth_vs_cx': depth_vs_cx}
+        return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()[:32]
+
+    # This function returns the stored circuit of key as a GateStream on read-only memory maps,
+    # or None if there is none.
+    def load(self, key):
+        entry = os.path.join(self.path, key)
+        try:
+            with open(os.path.join(entry, 'meta.json')) as file:
+                meta = json.load(file)
+            arrays = [np.load(os.path.join(entry, name + '.npy'), mmap_mode='r') for name in _ARRAYS]
+            os.utime(entry)
+        except (OSError, ValueError):
+            return None
+        basis = meta.get('basis_gates')
+        return GateStream.from_arrays(*arrays, num_qubits=meta['num_qubits'], global_phase=meta['global_phase'],
+                                      basis=None if basis is None else tuple(basis), copy=False)
+
+    # This function stores gates under key and returns the size of the entry in bytes.
+    def save(self, key, gates, **meta):
+        entry = os.path.join(self.path, key)
+        temporary = tempfile.mkdtemp(prefix='.tmp-' + key + '-', dir=self.path)
+        try:
+            os.chmod(temporary, 0o755)
+            for name in _ARRAYS:
+                np.save(os.path.join(temporary, name + '.npy'), np.ascontiguousarray(getattr(gates, name)))
+            meta.update({'num_qubits': gates.num_qubits, 'global_phase': gates.global_phase,
+                         'basis_gates': None if gates.basis is None else list(gates.basis), 'gates': len(gates),
+                         'cx': gates.count_ops().get('cx', 0), 'code': code_version(), 'created': time.time()})
+            with open(os.path.join(temporary, 'meta.json'), 'w') as file:
+                json.dump(meta, file)
+            size = _entry_size(temporary)
+            try:
+                os.rename(temporary, entry)
+            except OSError:
+                # Another writer stored the same entry first.
+                shutil.rmtree(temporary, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise
+        self.evict()
+        return size
+
+    # This function returns the stored build, building and storing it first if it is not in the store.
+    def get(self, n, variant='combined', basis='ibm', error_budget=0.0, depth_vs_cx='cx'):
+        key = self.key(n, variant=variant, basis=basis, error_budget=error_budget, depth_vs_cx=depth_vs_cx)
+        gates = self.load(key)
+        if gates is not None:
+            self.hits += 1
+            return gates
+        self.misses += 1
+        gates = build_toffoli(n, variant=variant, basis=basis, error_budget=error_budget, depth_vs_cx=depth_vs_cx)
+        self.save(key, gates, n=n, variant=variant, basis=basis, error_budget=error_budget, depth_vs_cx=depth_vs_cx)
+        return gates
+
+    # This function returns the entries as (key, size in bytes, last use) tuples, least recently used first.
+    def entries(self):
+        entries = []
+        for key in os.listdir(self.path):
+            entry = os.path.join(self.path, key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            try:
+                entries.append((key, _entry_size(entry), os.stat(entry).st_mtime))
+            except OSError:
+                continue
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    # This function removes one entry, renaming it away first so that it disappears at once.
+    def remove(self, key):
+        removed = os.path.join(self.path, '.removed-%s-%d' % (key, os.getpid()))
+        try:
+            os.rename(os.path.join(self.path, key), removed)
+        except OSError:
+            return False
+        shutil.rmtree(removed, ignore_errors=True)
+        return True
+
+    # This function removes the temporary directories (of writers and of removed entries) older than
+    # STALE_SECONDS, which only a killed process leaves behind, and returns their number.
+    def remove_stale(self, max_age=STALE_SECONDS):
+        removed = 0
+        now = time.time()
+        for name in os.listdir(self.path):
+            if not name.startswith(('.tmp-', '.removed-')):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                if now - os.stat(path).st_mtime <= max_age:
+                    continue
+            except OSError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+        return removed
+
+    # This function removes the stale temporary directories and then the least recently used entries until
+    # the store takes at most max_bytes.
+    def evict(self, max_bytes=None):
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        self.remove_stale()
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total <= max_bytes:
+                break
+            if self.remove(key):
+                total -= size
+        return total
+
+    def clear(self):
+        for key, _, _ in self.entries():
+            self.remove(key)
+
+    def info(self):
+        entries = self.entries()
+        return {'path': self.path, 'entries': len(entries), 'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses, 'code': code_version()}
+
+
+def _entry_size(entry):
+    return sum(os.stat(os.path.join(entry, name)).st_size for name in os.listdir(entry))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load compiled n-qubit Toffolis from the store, building the '
+                                                 'missing ones.')
+    parser.add_argument('n', type=int, nargs='*')
+    parser.add_argument('--variant', choices=VARIANTS, default='combined')
+    parser.add_argument('--basis', choices=list(BASES), default='ibm')
+    parser.add_argument('--error-budget', type=float, default=0.0)
+    parser.add_argument('--depth-vs-cx', choices=n_toffoli_decomp_utils.DEPTH_VS_CX_POLICIES, default='cx')
+    parser.add_argument('--store', default=None, help='store directory (default: $QULIN_STORE or ~/.cache/qulin)')
+    parser.add_argument('--max-bytes', type=float, default=DEFAULT_MAX_BYTES)
+    parser.add_argument('--clear', action='store_true', help='remove every entry first')
+    args = parser.parse_args()
+
+    store = CircuitStore(args.store, max_bytes=int(args.max_bytes))
+    if args.clear:
+        store.clear()
+    for n in args.n:
+        hits = store.hits
+        start = time.perf_counter()
+        gates = store.get(n, variant=args.variant, basis=args.basis, error_budget=args.error_budget,
+                          depth_vs_cx=args.depth_vs_cx)
+        elapsed = time.perf_counter() - start
+        print('%d: %d gates, %d cx in %.4fs (%s)' % (n, len(gates), gates.count_ops().get('cx', 0), elapsed,
+                                                   'loaded' if store.hits > hits else 'built and stored'))
+    print(json.dumps(store.info()))
@@ -0,0 +1,204 @@
+import argparse
+import math
+
+import numpy as np
+
+from gate_stream import GateStream, OP_X, OP_CX, OP_CCX, OP_RY, OP_U1, OP_NAMES
+from n_toffoli_decomp_utils import large_increment_gate, large_plus_1_gate_w_enough_ancilla, \
+    large_plus_1_gate_low_depth, large_toffoli_w_enough_ancilla, DEPTH_VS_CX_POLICIES
+
+
+# This function draws a batch of random basis states, packed 64 states per uint64 word for every qubit.
+def random_states(num_qubits, samples, rng):
+    words = (samples + 63) // 64
+    return rng.integers(0, 2 ** 64, size=(num_qubits, words), dtype=np.uint64, endpoint=False)
+
+
+def _is_ry(ops, params, idx, qubits, target, theta):
+    return ops[idx] == OP_RY and qubits[idx][0] == target and math.isclose(params[idx], theta, abs_tol=1e-12)
+
+
+# This function simulates a permutation circuit on basis states in place, one row of states per qubit.
+# Besides X, CX, CCX and U1 it accepts the RY(-pi/4) CX RY(-pi/4) ... RY(pi/4) CX RY(pi/4) blocks of
+# large_toffoli_w_enough_ancilla: on basis states, A S A^dagger with A = RY(-pi/4)_t CX(b, t) RY(-pi/4)_t
+# flips t by g AND b, where g is the flip S applies to t, and multiplies by -1 if g AND NOT b AND NOT t,
+# as long as S never reads t nor writes b.
+# states may be packed (uint64 words, 64 states each) or unpacked (bool). phases, one angle per state,
+# is only tracked for unpacked states; with phases=None the simulation is up to phases.
+def simulate_classical(gates, states, phases=None):
+    ops = gates.ops.tolist()
+    qubits = gates.qubits.tolist()
+    params = gates.params[:, 0].tolist()
+
+    # next_ry[idx] is the index of the next RY gate on the qubit of the RY gate idx.
+    next_ry = [-1] * len(ops)
+    last_ry = {}
+    for idx in range(len(ops) - 1, -1, -1):
+        if ops[idx] == OP_RY:
+            next_ry[idx] = last_ry.get(qubits[idx][0], -1)
+            last_ry[qubits[idx][0]] = idx
+
+    # Open blocks, and the qubits they forbid to read (the t's) or to write (the b's).
+    frames = []
+    no_read = [0] * len(states)
+    no_write = [0] * len(states)
+
+    idx = 0
+    while idx < len(ops):
+        if frames and idx == frames[-1][0]:
+            end, target, control, target_before = frames.pop()
+            if not (_is_ry(ops, params, end, qubits, target, math.pi / 4) and ops[end + 1] == OP_CX
+                    and qubits[end + 1][:2] == [control, target]
+                    and _is_ry(ops, params, end + 2, qubits, target, math.pi / 4)):
+                raise ValueError('gate %d does not close the relative-phase block opened on qubit %d' % (end, target))
+            no_read[target] -= 1
+            no_write[control] -= 1
+            flip = states[target] ^ target_before
+            if phases is not None:
+                phases += math.pi * (flip & ~states[control] & ~target_before)
+            states[target] = target_before ^ (flip & states[control])
+            idx = end + 3
+            continue
+
+        op = ops[idx]
+        q0, q1, q2 = qubits[idx]
+        if op == OP_X:
+            if no_write[q0]:
+                raise ValueError('gate %d writes a qubit an open block depends on' % idx)
+            states[q0] = ~states[q0]
+        elif op == OP_CX:
+            if no_read[q0] or no_write[q1]:
+                raise ValueError('gate %d uses a qubit held by an open block' % idx)
+            states[q1] ^= states[q0]
+        elif op == OP_CCX:
+            if no_read[q0] or no_read[q1] or no_write[q2]:
+                raise ValueError('gate %d uses a qubit held by an open block' % idx)
+            states[q2] ^= states[q0] & states[q1]
+        elif op == OP_U1:
+            if no_read[q0]:
+                raise ValueError('gate %d uses a qubit held by an open block' % idx)
+            if phases is not None:
+                phases += math.fmod(params[idx], 2 * math.pi) * states[q0]
+        elif op == OP_RY:
+            end = next_ry[idx + 2] if idx + 2 < len(ops) else -1
+            if not (_is_ry(ops, params, idx, qubits, q0, - math.pi / 4) and ops[idx + 1] == OP_CX
+                    and qubits[idx + 1][1] == q0 and _is_ry(ops, params, idx + 2, qubits, q0, - math.pi / 4)
+                    and end >= 0):
+                raise ValueError('gate %d is an RY that does not open a relative-phase block' % idx)
+            control = qubits[idx + 1][0]
+            if no_read[control] or no_write[q0]:
+                raise ValueError('gate %d uses a qubit held by an open block' % idx)
+            frames.append((end, q0, control, states[q0].copy()))
+            no_read[q0] += 1
+            no_write[control] += 1
+            idx += 3
+            continue
+        else:
+            raise ValueError('gate %d (%s) is not a classical gate' % (idx, OP_NAMES[op]))
+        idx += 1
+
+    if frames:
+        raise ValueError('the relative-phase block opened on qubit %d is never closed' % frames[-1][1])
+    return states
+
+
+# This function adds (or subtracts) 1 to the register held by rows of states, least significant qubit first.
+def _add_one(states, flag_add=True):
+    result = states.copy()
+    carry = np.full(states.shape[1], 0xFFFFFFFFFFFFFFFF, dtype=np.uint64)
+    for idx in range(len(states)):
+        result[idx] = states[idx] ^ carry
+        carry = carry & (states[idx] if flag_add else ~states[idx])
+    return result
+
+
+def _mismatch_report(outputs, expected, states, samples):
+    diff = np.bitwise_or.reduce(outputs ^ expected, axis=0)
+    bits = np.unpackbits(diff.view(np.uint8), bitorder='little')[:samples]
+    mismatches = int(bits.sum())
+    report = {'samples': samples, 'mismatches': mismatches, 'first_mismatch': None}
+    if mismatches:
+        sample = int(np.argmax(bits))
+        word, bit = divmod(sample, 64)
+        report['first_mismatch'] = ''.join(str(int(state[word] >> np.uint64(bit)) & 1) for state in states)
+    return report
+
+
+def _verify(gates, num_qubits, samples, seed, expected_function):
+    rng = np.random.default_rng(seed)
+    states = random_states(num_qubits, samples, rng)
+    outputs = simulate_classical(gates, states.copy())
+    return _mismatch_report(outputs, expected_function(states), states, samples)
+
+
+# This function checks that large_plus_1_gate_w_enough_ancilla (or, with depth_vs_cx='depth',
+# large_plus_1_gate_low_depth) adds 1 modulo 2^k to k qubits, with k dirty ancillas restored.
+def verify_plus_1(k, samples=1 << 16, seed=None, depth_vs_cx='cx'):
+    gates = GateStream(2 * k)
+    plus_1_gate = large_plus_1_gate_low_depth if depth_vs_cx == 'depth' else large_plus_1_gate_w_enough_ancilla
+    plus_1_gate(qc=gates, operated_qubits=list(range(k)), ancilla_qubits=list(range(k, 2 * k)))
+
+    def expected(states):
+        result = states.copy()
+        result[:k] = _add_one(states[:k])
+        return result
+
+    return _verify(gates, 2 * k, samples, seed, expected)
+
+
+# This function checks that large_increment_gate adds (flag_add=True) or subtracts 1 modulo 2^m,
+# with its one or two dirty ancillas restored.
+def verify_increment(m, flag_add=True, ancilla_n=1, samples=1 << 16, seed=None, depth_vs_cx='cx'):
+    gates = GateStream(m + ancilla_n)
+    large_increment_gate(qc=gates, operated_qubits=list(range(m)), ancilla_qubits=list(range(m, m + ancilla_n)),
+                         flag_add=flag_add, depth_vs_cx=depth_vs_cx)
+
+    def expected(states):
+        result = states.copy()
+        result[:m] = _add_one(states[:m], flag_add=flag_add)
+        return result
+
+    return _verify(gates, m + ancilla_n, samples, seed, expected)
+
+
+# This function checks that large_toffoli_w_enough_ancilla flips the target by the AND of k controls,
+# with its k - 2 dirty ancillas restored.
+def verify_toffoli(k, samples=1 << 16, seed=None):
+    ancilla_n = max(k - 2, 0)
+    gates = GateStream(k + 1 + ancilla_n)
+    large_toffoli_w_enough_ancilla(qc=gates, operated_qubits=list(range(k + 1)),
+                                   ancilla_qubits=list(range(k + 1, k + 1 + ancilla_n)))
+
+    def expected(states):
+        result = states.copy()
+        result[k] ^= np.bitwise_and.reduce(states[:k], axis=0)
+        return result
+
+    return _verify(gates, k + 1 + ancilla_n, samples, seed, expected)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Verify the classical sub-circuits of Qulin on random basis states.')
+    parser.add_argument('k_min', type=int)
+    parser.add_argument('k_max', type=int)
+    parser.add_argument('--step', type=int, default=1)
+    parser.add_argument('--samples', type=int, default=1 << 16)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--depth-vs-cx', choices=DEPTH_VS_CX_POLICIES, default='cx',
+                        help='the U_{+1} construction to verify')
+    args = parser.parse_args()
+
+    for k in range(args.k_min, args.k_max + 1, args.step):
+        checks = [('plus_1', verify_plus_1(k, samples=args.samples, seed=args.seed, depth_vs_cx=args.depth_vs_cx)),
+                  ('toffoli', verify_toffoli(k, samples=args.samples, seed=args.seed))]
+        for ancilla_n in (1, 2):
+            # large_increment_gate borrows the second half and its ancillas to add 1 to the first half.
+            if k - (k // 2 + 1) + ancilla_n < k // 2 + 1:
+                continue
+            for flag_add in (True, False):
+                checks.append(('increment_%s_%d' % ('add' if flag_add else 'sub', ancilla_n),
+                               verify_increment(k, flag_add=flag_add, ancilla_n=ancilla_n, samples=args.samples,
+                                                seed=args.seed, depth_vs_cx=args.depth_vs_cx)))
+        for name, report in checks:
+            status = 'ok' if not report['mismatches'] else 'MISMATCH %s' % report['first_mismatch']
+            print(k, name, report['mismatches'], status)
@@ -0,0 +1,160 @@
+import argparse
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from classical_verifier import simulate_classical
+from gate_stream import GateStream
+from n_toffoli_decomp_utils import QULIN_THETA, ccz_qulin_combined, ladder_thetas, ladder_size, \
+    DEPTH_VS_CX_POLICIES
+
+
+_worker = {}
+
+
+# This function builds the n-qubit CCZ of ccz_qulin_combined with the emitted gates kept as they are.
+def build_ccz(n, error_budget=0.0, depth_vs_cx='cx'):
+    gates = GateStream(n)
+    ccz_qulin_combined(gates, list(range(n)), error_budget=error_budget, depth_vs_cx=depth_vs_cx)
+    return gates
+
+
+def _basis_states(n, start, size):
+    x = np.arange(start, start + size, dtype=np.uint64)
+    return np.array([(x >> np.uint64(q)) & np.uint64(1) for q in range(n)], dtype=bool)
+
+
+# This function returns the number of states in a chunk whose output differs from the CCZ diagonal by more
+# than tolerance, relative to the phase reference_phase of |0...0>, the first of them as a bit string
+# (qubit 0 first) and the largest distance |e^(i phase) - e^(i expected phase)| (2 for a wrong output).
+def _compare(states, outputs, phases, reference_phase, tolerance):
+    all_ones = np.logical_and.reduce(states, axis=0)
+    error = 2 * np.abs(np.sin((phases - reference_phase - math.pi * all_ones) / 2))
+    error[np.any(outputs != states, axis=0)] = 2.0
+    bad = error > tolerance
+    mismatches = int(bad.sum())
+    first_mismatch = None
+    if mismatches:
+        first_mismatch = ''.join('1' if bit else '0' for bit in states[:, int(np.argmax(bad))])
+    return mismatches, first_mismatch, float(error.max(initial=0.0))
+
+
+def _simulate(gates, states):
+    phases = np.zeros(states.shape[1])
+    outputs = simulate_classical(gates, states.copy(), phases)
+    return outputs, phases
+
+
+def _init_worker(n, reference_phase, tolerance, error_budget, depth_vs_cx):
+    _worker['gates'] = build_ccz(n, error_budget, depth_vs_cx)
+    _worker['n'] = n
+    _worker['reference_phase'] = reference_phase
+    _worker['tolerance'] = tolerance
+
+
+def _check_range(start, size):
+    states = _basis_states(_worker['n'], start, size)
+    outputs, phases = _simulate(_worker['gates'], states)
+    return _compare(states, outputs, phases, _worker['reference_phase'], _worker['tolerance'])
+
+
+def _check_random(seed, size):
+    states = np.random.default_rng(seed).random((_worker['n'], size)) < 0.5
+    outputs, phases = _simulate(_worker['gates'], states)
+    return _compare(states, outputs, phases, _worker['reference_phase'], _worker['tolerance'])
+
+
+# This function checks that ccz_qulin_combined on n qubits is exactly the CCZ diagonal, up to a global phase.
+# It tracks the permutation and the phase of every computational basis state, chunk_size states at a time
+# per worker process, so the memory stays bounded. It checks all 2^n states, or samples random ones
+# (plus |1...1>) if samples is given. The circuits need to be phase-permutation circuits up to
+# relative-phase Toffolis, which holds for Qulin (n >= 23); SmallQulin raises ValueError.
+# With error_budget > 0 it checks the approximate circuit against the global phase of the exact one:
+# max_error is then its operator-norm distance from the exact circuit (over the checked states), which
+# must stay within the proven error_bound.
+def check_ccz_qulin(n, chunk_size=1 << 16, workers=None, samples=None, seed=None, tolerance=1e-6, error_budget=0.0,
+                    depth_vs_cx='cx'):
+    corner_states = np.array([[False, True]] * n)
+    reference_phase = _simulate(build_ccz(n), corner_states)[1][0]
+    error_bound = ladder_thetas(QULIN_THETA / 2, ladder_size(n), error_budget)[1]
+    tolerance += error_bound
+
+    outputs, phases = _simulate(build_ccz(n, error_budget, depth_vs_cx), corner_states)
+    mismatches, first_mismatch, max_error = _compare(corner_states, outputs, phases, reference_phase, tolerance)
+
+    if samples is None:
+        total = 1 << n
+        tasks = [(start, min(chunk_size, total - start)) for start in range(0, total, chunk_size)]
+        check = _check_range
+    else:
+        total = samples
+        seeds = np.random.SeedSequence(seed).generate_state(math.ceil(samples / chunk_size))
+        tasks = [(int(task_seed), min(chunk_size, samples - idx * chunk_size)) for idx, task_seed in enumerate(seeds)]
+        check = _check_random
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(n, reference_phase, tolerance, error_budget, depth_vs_cx)) as executor:
+        for chunk_mismatches, chunk_first_mismatch, chunk_max_error in executor.map(check, *zip(*tasks)):
+            mismatches += chunk_mismatches
+            max_error = max(max_error, chunk_max_error)
+            if first_mismatch is None:
+                first_mismatch = chunk_first_mismatch
+
+    return {'n': n, 'states': total, 'exhaustive': samples is None, 'mismatches': mismatches,
+            'first_mismatch': first_mismatch, 'max_error': max_error, 'error_bound': error_bound}
+
+
+# This function checks small n, including SmallQulin, by evolving one statevector with random phases
+# and comparing it with the CCZ diagonal applied to the same state. It needs 2^n amplitudes.
+# With error_budget > 0 it compares the approximate circuit with the exact one instead: max_error is the norm
+# of the difference of the two evolved states, at most their operator-norm distance and so at most error_bound.
+def check_ccz_dense(n, seed=None, tolerance=1e-6, error_budget=0.0, depth_vs_cx='cx'):
+    from qiskit.quantum_info import Statevector
+
+    rng = np.random.default_rng(seed)
+    amplitudes = np.exp(2j * math.pi * rng.random(1 << n)) / math.sqrt(1 << n)
+    state = Statevector(amplitudes).evolve(build_ccz(n, depth_vs_cx=depth_vs_cx).to_circuit()).data
+
+    expected = amplitudes.copy()
+    expected[-1] *= -1
+    global_phase = np.vdot(expected, state)
+    error = float(np.max(np.abs(state - global_phase / abs(global_phase) * expected)))
+    report = {'n': n, 'states': 1 << n, 'exhaustive': True, 'mismatches': int(error > tolerance), 'error': error}
+
+    if error_budget > 0:
+        approximate_state = Statevector(amplitudes).evolve(build_ccz(n, error_budget, depth_vs_cx).to_circuit()).data
+        report['error_bound'] = ladder_thetas(QULIN_THETA / 2, ladder_size(n), error_budget)[1]
+        report['max_error'] = float(np.linalg.norm(approximate_state - state))
+        report['mismatches'] += int(report['max_error'] > report['error_bound'] + tolerance)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that ccz_qulin_combined implements the n-qubit CCZ.')
+    parser.add_argument('n_min', type=int)
+    parser.add_argument('n_max', type=int, nargs='?')
+    parser.add_argument('--samples', type=int, default=None, help='check random basis states instead of all 2^n')
+    parser.add_argument('--chunk-size', type=int, default=1 << 16)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--error-budget', type=float, default=0.0,
+                        help='check the approximate circuit against its proven operator-norm error bound')
+    parser.add_argument('--depth-vs-cx', choices=DEPTH_VS_CX_POLICIES, default='cx',
+                        help='the U_{+1} construction to check')
+    args = parser.parse_args()
+
+    for n in range(args.n_min, (args.n_min if args.n_max is None else args.n_max) + 1):
+        start = time.perf_counter()
+        if n <= 22:
+            report = check_ccz_dense(n, seed=args.seed, error_budget=args.error_budget, depth_vs_cx=args.depth_vs_cx)
+        else:
+            report = check_ccz_qulin(n, chunk_size=args.chunk_size, workers=args.workers,
+                                     samples=args.samples, seed=args.seed, error_budget=args.error_budget,
+                                     depth_vs_cx=args.depth_vs_cx)
+        bounds = ()
+        if args.error_budget > 0:
+            bounds = ('%.3g' % report['max_error'], '%.3g' % report['error_bound'])
+        print(n, report['states'], report['mismatches'], *bounds, 'ok' if not report['mismatches'] else 'MISMATCH',
+              '%.1fs' % (time.perf_counter() - start))
@@ -0,0 +1,116 @@
+import argparse
+import json
+import math
+import time
+
+import numpy as np
+
+from gate_stream import CLIFFORD_T_BASIS, OP_CODES, OP_CX, OP_RZ, OP_T, OP_TDG
+from n_toffoli_decomp_utils import DEPTH_VS_CX_POLICIES
+from sweep import VARIANTS, build_toffoli
+
+
+# This function returns the T count of the nearest U1(k pi / 4) if it is within precision of U1(theta),
+# which any synthesis then returns, or None.
+def nearest_clifford_t_count(theta, precision):
+    eighths = round(theta / (math.pi / 4))
+    if 2 * abs(math.sin((theta - eighths * math.pi / 4) / 2)) <= precision:
+        return eighths % 2
+    return None
+
+
+# The rotation-synthesis cost models: the number of T gates of one RZ(theta) approximated within precision
+# in operator norm. Any function of theta and precision can be used instead.
+# gridsynth is the ancilla-free approximation of Ross and Selinger, 3 log2(1 / precision) T gates
+# up to a term of order log log(1 / precision).
+def gridsynth_t_count(theta, precision):
+    t_count = nearest_clifford_t_count(theta, precision)
+    if t_count is None:
+        t_count = math.ceil(3 * math.log2(1 / precision))
+    return t_count
+
+
+# rus is the repeat-until-success synthesis of Bocharov, Roetteler and Svore, with one ancilla and
+# 1.15 log2(1 / precision) T gates on average.
+def repeat_until_success_t_count(theta, precision):
+    t_count = nearest_clifford_t_count(theta, precision)
+    if t_count is None:
+        t_count = math.ceil(1.15 * math.log2(1 / precision))
+    return t_count
+
+
+ROTATION_COST_MODELS = {'gridsynth': gridsynth_t_count, 'rus': repeat_until_success_t_count}
+
+_CLIFFORD_T_OPS = [OP_CODES[name] for name in CLIFFORD_T_BASIS]
+
+
+# This function returns the fault-tolerant cost of a stream lowered into the Clifford+T basis: the T gates of
+# its exact part, the RZ rotations left and the T gates their synthesis takes within precision each under
+# rotation_cost (a name of ROTATION_COST_MODELS or a function of theta and precision), the total T count,
+# and the T depth with the T gates of every synthesized rotation in sequence.
+def clifford_t_cost(gates, precision=1e-10, rotation_cost='gridsynth'):
+    if isinstance(rotation_cost, str):
+        rotation_cost = ROTATION_COST_MODELS[rotation_cost]
+    ops, qubits = gates.ops, gates.qubits
+    if not np.isin(ops, _CLIFFORD_T_OPS).all():
+        raise ValueError('the gates are not lowered into the Clifford+T basis')
+
+    is_t = (ops == OP_T) | (ops == OP_TDG)
+    is_rotation = ops == OP_RZ
+    weights = is_t.astype(np.int64)
+    weights[is_rotation] = [rotation_cost(theta, precision) for theta in gates.params[is_rotation, 0].tolist()]
+
+    # Single-qubit Clifford gates leave the T depth of their qubit as it is, so only T gates, rotations
+    # and CX are walked.
+    num_qubits = gates.num_qubits if gates.num_qubits is not None else int(qubits.max(initial=-1)) + 1
+    times = [0] * num_qubits
+    kept = np.flatnonzero((weights > 0) | (ops == OP_CX))
+    for (q0, q1), weight in zip(qubits[kept, :2].tolist(), weights[kept].tolist()):
+        if q1 < 0:
+            times[q0] += weight
+        else:
+            times[q0] = times[q1] = max(times[q0], times[q1])
+
+    t_count = int(is_t.sum())
+    rotations = int(is_rotation.sum())
+    rotation_t_count = int(weights[is_rotation].sum())
+    return {'t_count': t_count, 'rotations': rotations, 'rotation_t_count': rotation_t_count,
+            'total_t_count': t_count + rotation_t_count, 't_depth': max(times, default=0),
+            'cx': int((ops == OP_CX).sum()), 'clifford': len(ops) - t_count - rotations,
+            'synthesis_error': rotations * precision}
+
+
+# This function builds the n-qubit Toffoli of sweep.build_toffoli in the Clifford+T basis and returns its cost.
+def estimate_clifford_t(n, precision=1e-10, rotation_cost='gridsynth', variant='combined', error_budget=0.0,
+                        depth_vs_cx='cx'):
+    gates = build_toffoli(n, variant=variant, basis='clifford_t', error_budget=error_budget, depth_vs_cx=depth_vs_cx)
+    return clifford_t_cost(gates, precision=precision, rotation_cost=rotation_cost)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Estimate the T count and T depth of the n-qubit Toffoli built by '
+                                                 'Qulin in the Clifford+T basis. Every line is n, T count, '
+                                                 'rotations, T count of the rotations, total T count, T depth.')
+    parser.add_argument('n_min', type=int)
+    parser.add_argument('n_max', type=int, nargs='?')
+    parser.add_argument('--step', type=int, default=1)
+    parser.add_argument('--precision', type=float, default=1e-10,
+                        help='operator-norm error of every synthesized rotation')
+    parser.add_argument('--rotation-cost', choices=list(ROTATION_COST_MODELS), default='gridsynth')
+    parser.add_argument('--variant', choices=VARIANTS, default='combined')
+    parser.add_argument('--error-budget', type=float, default=0.0,
+                        help='drop negligible controlled phases within this operator-norm error')
+    parser.add_argument('--depth-vs-cx', choices=DEPTH_VS_CX_POLICIES, default='cx')
+    parser.add_argument('--json', action='store_true', help='print one JSON object per n')
+    args = parser.parse_args()
+
+    n_max = args.n_min if args.n_max is None else args.n_max
+    for n in range(args.n_min, n_max + 1, args.step):
+        start = time.perf_counter()
+        cost = estimate_clifford_t(n, precision=args.precision, rotation_cost=args.rotation_cost,
+                                   variant=args.variant, error_budget=args.error_budget, depth_vs_cx=args.depth_vs_cx)
+        if args.json:
+            print(json.dumps(dict(n=n, time=time.perf_counter() - start, **cost)))
+        else:
+            print(n, cost['t_count'], cost['rotations'], cost['rotation_t_count'], cost['total_t_count'],
+                  cost['t_depth'])
@@ -0,0 +1,406 @@
+import itertools
+import math
+
+import numpy as np
+
+
+# Opcodes of the gates emitted by the decomposition functions in n_toffoli_decomp_utils.py,
+# followed by the basis gates they are lowered into.
+OP_X = 0
+OP_H = 1
+OP_CX = 2
+OP_CCX = 3
+OP_RY = 4
+OP_U1 = 5
+OP_U2 = 6
+OP_U3 = 7
+OP_RZ = 8
+OP_SX = 9
+OP_S = 10
+OP_SDG = 11
+OP_T = 12
+OP_TDG = 13
+OP_Z = 14
+
+OP_NAMES = ('x', 'h', 'cx', 'ccx', 'ry', 'u1', 'u2', 'u3', 'rz', 'sx', 's', 'sdg', 't', 'tdg', 'z')
+OP_ARITY = (1, 1, 2, 3, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1)
+OP_CODES = {name: op for op, name in enumerate(OP_NAMES)}
+
+IBM_BASIS = ('u1', 'u2', 'u3', 'cx')
+RZ_SX_BASIS = ('rz', 'sx', 'x', 'cx')
+CLIFFORD_T_BASIS = ('h', 's', 'sdg', 't', 'tdg', 'z', 'x', 'cx', 'rz')
+BASES = {'ibm': IBM_BASIS, 'rz_sx': RZ_SX_BASIS, 'clifford_t': CLIFFORD_T_BASIS, 'none': None}
+
+# Number of gates buffered as Python tuples before they are flushed into the NumPy arrays.
+_FLUSH_SIZE = 4096
+
+_NO_PARAMS = (0.0, 0.0, 0.0)
+_PADDING = ((), (-1, -1), (-1,), ())
+
+
+def _fixed(*params):
+    params = tuple(params) + _NO_PARAMS[len(params):]
+    return lambda theta: params
+
+
+def _no_phase(theta):
+    return 0.0
+
+
+_H_RZ_SX = [(OP_RZ, (0,), _fixed(math.pi / 2)), (OP_SX, (0,), _fixed()), (OP_RZ, (0,), _fixed(math.pi / 2))]
+
+
+def _ccx_lowering(h_sequence, t_op, t_params, tdg_params):
+    h_on_target = [(op, (2,), params) for op, _, params in h_sequence]
+    return h_on_target + [
+        (OP_CX, (1, 2), _fixed()), (t_op, (2,), tdg_params), (OP_CX, (0, 2), _fixed()), (t_op, (2,), t_params),
+        (OP_CX, (1, 2), _fixed()), (t_op, (1,), t_params), (t_op, (2,), tdg_params), (OP_CX, (0, 2), _fixed()),
+        (OP_CX, (0, 1), _fixed()), (t_op, (0,), t_params), (t_op, (1,), tdg_params), (OP_CX, (0, 1), _fixed()),
+        (t_op, (2,), t_params)] + h_on_target
+
+
+# The Toffoli gate of T-depth 3 with 7 T and 7 CX: H on the target around CCZ as the phase polynomial
+# pi abc = pi / 4 (a + b + c - (a ^ b) - (a ^ c) - (b ^ c) + (a ^ b ^ c)), whose parities take three layers.
+_CCX_CLIFFORD_T = [
+    (OP_H, (2,), _fixed()), (OP_T, (0,), _fixed()), (OP_T, (1,), _fixed()), (OP_T, (2,), _fixed()),
+    (OP_CX, (0, 2), _fixed()), (OP_CX, (2, 1), _fixed()), (OP_CX, (1, 0), _fixed()),
+    (OP_TDG, (0,), _fixed()), (OP_T, (1,), _fixed()), (OP_TDG, (2,), _fixed()), (OP_CX, (2, 0), _fixed()),
+    (OP_TDG, (0,), _fixed()), (OP_CX, (2, 1), _fixed()), (OP_CX, (1, 0), _fixed()), (OP_CX, (0, 2), _fixed()),
+    (OP_H, (2,), _fixed())]
+
+# U1(k pi / 4) as Clifford+T gates for k = 0, ..., 7, the U1 rotation left to be synthesized, and RY(theta) as
+# S H RZ(theta) H S^dagger around either.
+def _ry_clifford_t_lowering(sequence, phase):
+    return ([(OP_SDG, (0,), _fixed()), (OP_H, (0,), _fixed())] + sequence
+            + [(OP_H, (0,), _fixed()), (OP_S, (0,), _fixed())], lambda theta: phase(theta) - theta / 2)
+
+
+_U1_CLIFFORD_T = [([(op, (0,), _fixed()) for op in ops], _no_phase)
+                  for ops in ([], [OP_T], [OP_S], [OP_S, OP_T], [OP_Z], [OP_Z, OP_T], [OP_SDG], [OP_TDG])]
+_U1_ROTATION = ([(OP_RZ, (0,), lambda theta: (theta, 0.0, 0.0))], lambda theta: theta / 2)
+_RY_CLIFFORD_T = [_ry_clifford_t_lowering(*lowering) for lowering in _U1_CLIFFORD_T]
+_RY_ROTATION = _ry_clifford_t_lowering(*_U1_ROTATION)
+
+
+# This function returns k if theta is k pi / 4 modulo 2 pi up to the rounding of theta, or None.
+# Angles near a multiple of pi / 4 but not at it are rotations like any other: approximating them is left to
+# the rotation synthesis.
+def clifford_t_eighths(theta):
+    eighths = round(theta / (math.pi / 4))
+    if abs(theta - eighths * math.pi / 4) <= 64 * math.ulp(theta):
+        return eighths % 8
+    return None
+
+
+# These functions lower U1(theta) and RY(theta) into the Clifford+T basis: exactly if theta is a multiple of
+# pi / 4, otherwise with an RZ rotation left to be synthesized.
+def _u1_clifford_t(theta):
+    eighths = clifford_t_eighths(theta)
+    return _U1_ROTATION if eighths is None else _U1_CLIFFORD_T[eighths]
+
+
+def _ry_clifford_t(theta):
+    eighths = clifford_t_eighths(theta)
+    return _RY_ROTATION if eighths is None else _RY_CLIFFORD_T[eighths]
+
+
+# The fixed expansions transpile(..., optimization_level=0) unrolls every emitted gate into.
+# LOWERINGS[basis][op] is the list of (basis opcode, local qubits, parameters as a function of theta)
+# together with the global phase the expansion adds, as a function of theta.
+# The Clifford+T basis is not a transpile() target: there the expansion of U1 and RY depends on the angle,
+# and LOWERINGS[basis][op] is a function of theta returning the pair.
+LOWERINGS = {
+    IBM_BASIS: {
+        OP_X: ([(OP_U3, (0,), _fixed(math.pi, 0.0, math.pi))], _no_phase),
+        OP_H: ([(OP_U2, (0,), _fixed(0.0, math.pi))], _no_phase),
+        OP_CX: ([(OP_CX, (0, 1), _fixed())], _no_phase),
+        OP_CCX: (_ccx_lowering([(OP_U2, (0,), _fixed(0.0, math.pi))], OP_U3,
+                               _fixed(0.0, 0.0, math.pi / 4), _fixed(0.0, 0.0, - math.pi / 4)), _no_phase),
+        OP_RY: ([(OP_U3, (0,), lambda theta: (theta, 0.0, 0.0))], _no_phase),
+        OP_U1: ([(OP_U1, (0,), lambda theta: (theta, 0.0, 0.0))], _no_phase),
+    },
+    RZ_SX_BASIS: {
+        OP_X: ([(OP_X, (0,), _fixed())], _no_phase),
+        OP_H: (_H_RZ_SX, lambda theta: math.pi / 4),
+        OP_CX: ([(OP_CX, (0, 1), _fixed())], _no_phase),
+        OP_CCX: (_ccx_lowering(_H_RZ_SX, OP_RZ, _fixed(math.pi / 4), _fixed(- math.pi / 4)),
+                 lambda theta: 5 * math.pi / 8),
+        OP_RY: ([(OP_RZ, (0,), _fixed(0.0)), (OP_SX, (0,), _fixed()),
+                 (OP_RZ, (0,), lambda theta: (theta + math.pi, 0.0, 0.0)), (OP_SX, (0,), _fixed()),
+                 (OP_RZ, (0,), _fixed(3 * math.pi))], lambda theta: 3 * math.pi / 2),
+        OP_U1: ([(OP_RZ, (0,), lambda theta: (theta, 0.0, 0.0))], lambda theta: theta / 2),
+    },
+    CLIFFORD_T_BASIS: {
+        OP_X: ([(OP_X, (0,), _fixed())], _no_phase),
+        OP_H: ([(OP_H, (0,), _fixed())], _no_phase),
+        OP_CX: ([(OP_CX, (0, 1), _fixed())], _no_phase),
+        OP_CCX: (_CCX_CLIFFORD_T, _no_phase),
+        OP_RY: _ry_clifford_t,
+        OP_U1: _u1_clifford_t,
+    },
+}
+
+
+# Number of parameters of every opcode, and the Qiskit gate classes, imported on first use.
+OP_PARAM_COUNTS = (0, 0, 0, 0, 1, 1, 2, 3, 1, 0, 0, 0, 0, 0, 0)
+_qiskit_gate_classes = []
+
+
+# This function returns the Qiskit gate for an opcode and its parameters.
+def qiskit_gate(op, params):
+    if not _qiskit_gate_classes:
+        from qiskit.circuit.library import XGate, HGate, CXGate, CCXGate, RYGate, U1Gate, U2Gate, U3Gate, RZGate, \
+            SXGate, SGate, SdgGate, TGate, TdgGate, ZGate
+
+        _qiskit_gate_classes.extend((XGate, HGate, CXGate, CCXGate, RYGate, U1Gate, U2Gate, U3Gate, RZGate, SXGate,
+                                     SGate, SdgGate, TGate, TdgGate, ZGate))
+    return _qiskit_gate_classes[op](*params[:OP_PARAM_COUNTS[op]])
+
+
+# This class is the base of every gate sink the decomposition functions can emit into.
+# A sink implements x, h, cx, ccx, ry and u1 with the same argument order as QuantumCircuit.
+# If basis is given, every gate is emitted as its fixed expansion in that basis, so no transpile() is needed.
+class GateSink:
+    global_phase = 0.0
+
+    def __init__(self, basis=None):
+        self.basis = None if basis is None else tuple(basis)
+        self._lowering = None if basis is None else LOWERINGS[self.basis]
+
+    # This function receives every emitted gate: an opcode, its qubits and three parameters.
+    def emit(self, op, qubits, params=_NO_PARAMS):
+        raise NotImplementedError
+
+    def _gate(self, op, qubits, theta=0.0):
+        if self._lowering is None:
+            self.emit(op, qubits, (theta, 0.0, 0.0))
+            return
+
+        lowering = self._lowering[op]
+        sequence, phase = lowering(theta) if callable(lowering) else lowering
+        for basis_op, local_qubits, params in sequence:
+            self.emit(basis_op, tuple(qubits[idx] for idx in local_qubits), params(theta))
+        if phase is not _no_phase:
+            self.global_phase += phase(theta)
+
+    def x(self, qubit):
+        self._gate(OP_X, (qubit,))
+
+    def h(self, qubit):
+        self._gate(OP_H, (qubit,))
+
+    def cx(self, control_qubit, target_qubit):
+        self._gate(OP_CX, (control_qubit, target_qubit))
+
+    def ccx(self, control_qubit_1, control_qubit_2, target_qubit):
+        self._gate(OP_CCX, (control_qubit_1, control_qubit_2, target_qubit))
+
+    def ry(self, theta, qubit):
+        self._gate(OP_RY, (qubit,), theta)
+
+    def u1(self, theta, qubit):
+        self._gate(OP_U1, (qubit,), theta)
+
+
+# This class implements a compact array-backed gate stream.
+# Every gate is stored as an opcode, up to three qubit indices (-1 if unused) and up to three float parameters.
+class GateStream(GateSink):
+    def __init__(self, num_qubits=None, capacity=1024, basis=None):
+        super().__init__(basis)
+        self.num_qubits = num_qubits
+        self._ops = np.empty(capacity, dtype=np.uint8)
+        self._qubits = np.empty((capacity, 3), dtype=np.int32)
+        self._params = np.empty((capacity, 3), dtype=np.float64)
+        self._size = 0
+        self._pending = []
+
+    def __len__(self):
+        return self._size + len(self._pending)
+
+    # This function wraps existing gate arrays (ops, qubits and params as stored by GateStream) into a stream.
+    # With copy=False the stream uses the arrays themselves, e.g. read-only memory maps, and copies them only
+    # when a gate is appended beyond their length. size is the number of gates already in the arrays (all of
+    # them by default); with a smaller one the next gates are appended in place, e.g. into a shared buffer.
+    @classmethod
+    def from_arrays(cls, ops, qubits, params, num_qubits=None, global_phase=0.0, basis=None, copy=True, size=None):
+        size = len(ops) if size is None else size
+        if copy or not len(ops):
+            gates = cls(num_qubits, capacity=max(len(ops), 1), basis=basis)
+            gates._ops[:size] = ops[:size]
+            gates._qubits[:size] = qubits[:size]
+            gates._params[:size] = params[:size]
+        else:
+            gates = cls(num_qubits, capacity=1, basis=basis)
+            gates._ops, gates._qubits, gates._params = ops, qubits, params
+        gates._size = size
+        gates.global_phase = global_phase
+        return gates
+
+    def _reserve(self, size):
+        capacity = len(self._ops)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        # Only the gates stored so far are copied; np.resize would also fill the new capacity.
+        ops = np.empty(capacity, dtype=np.uint8)
+        qubits = np.empty((capacity, 3), dtype=np.int32)
+        params = np.empty((capacity, 3), dtype=np.float64)
+        ops[:self._size] = self._ops[:self._size]
+        qubits[:self._size] = self._qubits[:self._size]
+        params[:self._size] = self._params[:self._size]
+        self._ops, self._qubits, self._params = ops, qubits, params
+
+    def _flush(self):
+        if not self._pending:
+            return
+        rows = np.fromiter(itertools.chain.from_iterable(self._pending), dtype=np.float64,
+                           count=7 * len(self._pending)).reshape(-1, 7)
+        end = self._size + len(rows)
+        self._reserve(end)
+        self._ops[self._size:end] = rows[:, 0]
+        self._qubits[self._size:end] = rows[:, 1:4]
+        self._params[self._size:end] = rows[:, 4:7]
+        self._size = end
+        self._pending = []
+
+    def append(self, op, q0, q1=-1, q2=-1, params=_NO_PARAMS):
+        self._pending.append((op, q0, q1, q2) + tuple(params))
+        if len(self._pending) >= _FLUSH_SIZE:
+            self._flush()
+
+    def emit(self, op, qubits, params=_NO_PARAMS):
+        self.append(op, *qubits, params=params)
+
+    # This function is GateSink._gate with emit() inlined, as it runs once per emitted gate.
+    def _gate(self, op, qubits, theta=0.0):
+        pending = self._pending
+        if self._lowering is None:
+            pending.append((op,) + qubits + _PADDING[len(qubits)] + (theta, 0.0, 0.0))
+        else:
+            lowering = self._lowering[op]
+            sequence, phase = lowering(theta) if callable(lowering) else lowering
+            for basis_op, local_qubits, params in sequence:
+                pending.append((basis_op,) + tuple(qubits[idx] for idx in local_qubits)
+                               + _PADDING[len(local_qubits)] + params(theta))
+            if phase is not _no_phase:
+                self.global_phase += phase(theta)
+        if len(pending) >= _FLUSH_SIZE:
+            self._flush()
+
+    # Without a basis the gates are stored as they are, so these skip _gate.
+    def x(self, qubit):
+        if self._lowering is None:
+            self._pending.append((OP_X, qubit, -1, -1, 0.0, 0.0, 0.0))
+            if len(self._pending) >= _FLUSH_SIZE:
+                self._flush()
+        else:
+            self._gate(OP_X, (qubit,))
+
+    def cx(self, control_qubit, target_qubit):
+        if self._lowering is None:
+            self._pending.append((OP_CX, control_qubit, target_qubit, -1, 0.0, 0.0, 0.0))
+            if len(self._pending) >= _FLUSH_SIZE:
+                self._flush()
+        else:
+            self._gate(OP_CX, (control_qubit, target_qubit))
+
+    def ccx(self, control_qubit_1, control_qubit_2, target_qubit):
+        if self._lowering is None:
+            self._pending.append((OP_CCX, control_qubit_1, control_qubit_2, target_qubit, 0.0, 0.0, 0.0))
+            if len(self._pending) >= _FLUSH_SIZE:
+                self._flush()
+        else:
+            self._gate(OP_CCX, (control_qubit_1, control_qubit_2, target_qubit))
+
+    @property
+    def ops(self):
+        self._flush()
+        return self._ops[:self._size]
+
+    @property
+    def qubits(self):
+        self._flush()
+        return self._qubits[:self._size]
+
+    @property
+    def params(self):
+        self._flush()
+        return self._params[:self._size]
+
+    # This function appends all gates of another stream, optionally relabeling its qubits through qubit_map.
+    def extend(self, other, qubit_map=None):
+        self._flush()
+        ops, qubits, params = other.ops, other.qubits, other.params
+        if qubit_map is not None:
+            qubit_map = np.append(np.asarray(qubit_map, dtype=np.int32), np.int32(-1))
+            qubits = qubit_map[qubits]
+        end = self._size + len(ops)
+        self._reserve(end)
+        self._ops[self._size:end] = ops
+        self._qubits[self._size:end] = qubits
+        self._params[self._size:end] = params
+        self._size = end
+        self.global_phase += other.global_phase
+
+    # This function returns the circuit depth, counted the same way as QuantumCircuit.depth().
+    def depth(self):
+        if self.num_qubits is None:
+            times = [0] * (int(self.qubits.max()) + 1 if len(self) else 0)
+        else:
+            times = [0] * self.num_qubits
+        for q0, q1, q2 in self.qubits.tolist():
+            if q1 < 0:
+                times[q0] += 1
+            elif q2 < 0:
+                times[q0] = times[q1] = max(times[q0], times[q1]) + 1
+            else:
+                times[q0] = times[q1] = times[q2] = max(times[q0], times[q1], times[q2]) + 1
+        return max(times, default=0)
+
+    def count_ops(self):
+        counts = np.bincount(self.ops, minlength=len(OP_NAMES))
+        return {name: int(cnt) for name, cnt in zip(OP_NAMES, counts) if cnt}
+
+    # This function converts the stream into a Qiskit QuantumCircuit.
+    def to_circuit(self, num_qubits=None):
+        from qiskit import QuantumCircuit
+        from qiskit.circuit import CircuitInstruction
+
+        if num_qubits is None:
+            num_qubits = self.num_qubits
+        if num_qubits is None:
+            num_qubits = int(self.qubits.max()) + 1 if len(self) else 0
+
+        qc = QuantumCircuit(num_qubits, global_phase=self.global_phase)
+        circuit_qubits = qc.qubits
+        # The gates and qubits are known to be valid, so the checks of QuantumCircuit.append are skipped.
+        for op, qubits, params in zip(self.ops.tolist(), self.qubits.tolist(), self.params.tolist()):
+            qc._append(CircuitInstruction(qiskit_gate(op, params),
+                                          tuple(circuit_qubits[qubit] for qubit in qubits[:OP_ARITY[op]])))
+        return qc
+
+
+# This class lets the decomposition functions emit directly into a Qiskit QuantumCircuit.
+class CircuitSink(GateSink):
+    def __init__(self, qc, basis=None):
+        super().__init__(basis)
+        self.qc = qc
+
+    @property
+    def global_phase(self):
+        return self.qc.global_phase
+
+    @global_phase.setter
+    def global_phase(self, value):
+        self.qc.global_phase = value
+
+    def emit(self, op, qubits, params=_NO_PARAMS):
+        self.qc.append(qiskit_gate(op, params), list(qubits))
+
+
+# This function returns qc itself if it is already a gate sink, or wraps a QuantumCircuit into one.
+def as_gate_sink(qc):
+    if isinstance(qc, GateSink):
+        return qc
+    return CircuitSink(qc)
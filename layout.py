@@ -0,0 +1,364 @@
+import argparse
+import time
+from collections import deque
+
+import numpy as np
+
+from gate_stream import GateStream, BASES, IBM_BASIS, OP_CX, OP_NAMES
+from n_toffoli_decomp_utils import DEPTH_VS_CX_POLICIES
+from sweep import build_toffoli
+
+
+# This function returns the coupling map of num_qubits qubits on a line (linear nearest neighbour).
+def line_coupling_map(num_qubits):
+    return [(qubit, qubit + 1) for qubit in range(num_qubits - 1)]
+
+
+# This function returns a heavy-hex coupling map as on IBM devices: rows of columns qubits on a line,
+# joined by one bridge qubit every 4 columns, at columns 0, 4, 8, ... below even rows and 2, 6, 10, ...
+# below odd rows. The qubits are numbered row by row, each row followed by the bridges below it,
+# e.g. rows=7, columns=15 gives 129 qubits close to the 127-qubit Eagle.
+def heavy_hex_coupling_map(rows, columns):
+    edges = []
+    row_start = 0
+    for row in range(rows):
+        edges += [(row_start + column, row_start + column + 1) for column in range(columns - 1)]
+        if row == rows - 1:
+            break
+        bridge_columns = range(0 if row % 2 == 0 else 2, columns, 4)
+        bridge_start = row_start + columns
+        next_row_start = bridge_start + len(bridge_columns)
+        for idx, column in enumerate(bridge_columns):
+            edges += [(row_start + column, bridge_start + idx), (bridge_start + idx, next_row_start + column)]
+        row_start = next_row_start
+    return edges
+
+
+# This function turns a coupling map, pairs of physical qubits or anything with get_edges() such as
+# Qiskit's CouplingMap, into the neighbours of every qubit. The coupling is taken as undirected.
+def coupling_neighbours(coupling_map):
+    edges = coupling_map.get_edges() if hasattr(coupling_map, 'get_edges') else coupling_map
+    edges = [(int(qubit_1), int(qubit_2)) for qubit_1, qubit_2 in edges]
+    num_qubits = max((max(edge) for edge in edges), default=-1) + 1
+    neighbours = [set() for _ in range(num_qubits)]
+    for qubit_1, qubit_2 in edges:
+        if qubit_1 != qubit_2:
+            neighbours[qubit_1].add(qubit_2)
+            neighbours[qubit_2].add(qubit_1)
+    return [sorted(qubits) for qubits in neighbours]
+
+
+# This function returns the matrix of shortest-path distances between physical qubits, by one BFS per qubit.
+def coupling_distances(neighbours):
+    num_qubits = len(neighbours)
+    distances = np.full((num_qubits, num_qubits), num_qubits, dtype=np.int32)
+    for source in range(num_qubits):
+        row = distances[source]
+        row[source] = 0
+        frontier = deque([source])
+        while frontier:
+            qubit = frontier.popleft()
+            for neighbour in neighbours[qubit]:
+                if row[neighbour] > row[qubit] + 1:
+                    row[neighbour] = row[qubit] + 1
+                    frontier.append(neighbour)
+    return distances
+
+
+# This function returns a long simple path through the coupling map, the line the qubits are placed on.
+# From every qubit it walks greedily to the unvisited neighbour with the fewest (Warnsdorff's rule) or the most
+# unvisited neighbours, breaking ties towards the lowest or the highest index, and it keeps the longest walk.
+# That is the whole line for a line and a snake through about 85% of the qubits for heavy-hex.
+def long_path(neighbours):
+    rules = [(sign, tie) for sign in (1, -1) for tie in (1, -1)]
+    best = []
+    for start in range(len(neighbours)):
+        for sign, tie in rules:
+            path = [start]
+            visited = {start}
+            while True:
+                free = [qubit for qubit in neighbours[path[-1]] if qubit not in visited]
+                if not free:
+                    break
+                qubit = min(free, key=lambda qubit: (sign * sum(1 for q in neighbours[qubit] if q not in visited),
+                                                     tie * qubit))
+                path.append(qubit)
+                visited.add(qubit)
+            if len(path) > len(best):
+                best = path
+        if len(best) == len(neighbours):
+            break
+    return best
+
+
+# This function returns the first num_qubits physical qubits of the initial layout: long_path, continued by
+# the other qubits nearest to it if the path is too short.
+def placement_qubits(neighbours, distances, num_qubits):
+    if num_qubits > len(neighbours):
+        raise ValueError('the coupling map has %d qubits, %d are needed' % (len(neighbours), num_qubits))
+    path = long_path(neighbours)
+    if len(path) < num_qubits:
+        on_path = set(path)
+        rest = [qubit for qubit in range(len(neighbours)) if qubit not in on_path]
+        rest.sort(key=lambda qubit: (int(distances[qubit, path].min()), qubit))
+        path = path + rest
+    return path[:num_qubits]
+
+
+# The orders in which the logical qubits are placed along the placement qubits. The split of the register
+# in large_increment_gate is fixed by its ancilla counts, so what can be fitted to the hardware is where each
+# half goes: 'identity' keeps the halves apart, 'interleaved' alternates them, so that the half borrowed as
+# dirty ancillas sits next to the half it serves, and 'centered' moves the last two qubits, the targets of
+# the controlled-phase ladders, to the middle of the line.
+def _identity_order(n):
+    return list(range(n))
+
+
+def _interleaved_order(n):
+    half = (n + 1) // 2
+    order = []
+    for idx in range(half):
+        order.append(idx)
+        if half + idx < n:
+            order.append(half + idx)
+    return order
+
+
+def _centered_order(n):
+    order = list(range(n - 2))
+    return order[:len(order) // 2] + [n - 2, n - 1] + order[len(order) // 2:]
+
+
+ORDERINGS = {'identity': _identity_order, 'interleaved': _interleaved_order, 'centered': _centered_order}
+
+# This function returns the coupling map as a Qiskit CouplingMap with both directions of every edge.
+def qiskit_coupling_map(neighbours):
+    from qiskit.transpiler import CouplingMap
+
+    return CouplingMap([[qubit, neighbour] for qubit in range(len(neighbours)) for neighbour in neighbours[qubit]])
+
+
+# This function relates the CX of a stream of one- and two-qubit gates to the single-qubit gates next to them.
+# It returns, for the j-th CX, whether a single-qubit gate comes next on its control (column 0) and on its
+# target (column 1), and for every single-qubit gate in order, the CX before it on its qubit (-1 if none) and
+# the column of that qubit in it.
+def _neighbouring_cx(qubits, is_cx):
+    cx_number = np.cumsum(is_cx) - 1
+    gate = np.concatenate([np.arange(len(qubits)), np.flatnonzero(is_cx)])
+    column = np.concatenate([np.zeros(len(qubits), dtype=np.int64), np.ones(int(is_cx.sum()), dtype=np.int64)])
+    qubit = qubits[gate, column]
+    order = np.lexsort((gate, qubit))
+    gate, column, qubit = gate[order], column[order], qubit[order]
+    incident_cx = is_cx[gate]
+    same_qubit = np.append(qubit[1:] == qubit[:-1], False)
+
+    followed = np.zeros((int(is_cx.sum()), 2), dtype=bool)
+    after_cx = incident_cx & same_qubit
+    after_cx[after_cx] = ~incident_cx[np.flatnonzero(after_cx) + 1]
+    followed[cx_number[gate[after_cx]], column[after_cx]] = True
+
+    # The last CX incidence up to every incidence, within the same qubit.
+    last = np.where(incident_cx, np.arange(len(gate)), -1)
+    last = np.maximum.accumulate(last)
+    group_start = np.flatnonzero(np.append(True, qubit[1:] != qubit[:-1]))
+    starts = group_start[np.searchsorted(group_start, np.arange(len(gate)), side='right') - 1]
+    last[last < starts] = -1
+    single = ~incident_cx
+    single_order = np.argsort(gate[single], kind='stable')
+    previous = last[single][single_order]
+    previous_cx = np.where(previous >= 0, cx_number[gate[previous]], -1)
+    previous_column = np.where(previous >= 0, column[previous], 0)
+    return followed, previous_cx, previous_column
+
+
+# This function routes a GateStream lowered into basis and placed on the physical qubits of the coupling map
+# with Qiskit's SabreSwap. Only the CX gates are handed to SabreSwap; every single-qubit gate is then placed
+# right after the CX before it on its qubit (or at the start), on the physical qubit that CX left it on.
+# Every SWAP becomes 3 CX starting in the orientation of the CX before it, so that the pair cancels when
+# no single-qubit gate stands between them. It returns the routed GateStream, the number of SWAPs and the
+# permutation of the physical qubits (the state of physical qubit p at the start ends on permutation[p]).
+def sabre_route(physical_gates, coupling, seed=0):
+    from qiskit import QuantumCircuit
+    from qiskit.circuit import CircuitInstruction
+    from qiskit.circuit.library import CXGate
+    from qiskit.transpiler.passes import SabreSwap
+
+    num_qubits = coupling.size()
+    ops, qubits, params = physical_gates.ops, physical_gates.qubits, physical_gates.params
+    is_cx = qubits[:, 1] >= 0
+    if (qubits[:, 2] >= 0).any() or (ops[is_cx] != OP_CX).any():
+        raise ValueError('cannot route gates on more than two qubits or other than CX, lower them first')
+    cx_gates = np.flatnonzero(is_cx)
+    cx_qubits = qubits[cx_gates, :2].tolist()
+
+    # pending[q] lists the CX on circuit qubit q (as indices into cx_gates), in order.
+    pending = [deque() for _ in range(num_qubits)]
+    cx_circuit = QuantumCircuit(num_qubits)
+    circuit_qubits = cx_circuit.qubits
+    cx = CXGate()
+    for idx, (control, target) in enumerate(cx_qubits):
+        pending[control].append(idx)
+        pending[target].append(idx)
+        cx_circuit._append(CircuitInstruction(cx, (circuit_qubits[control], circuit_qubits[target])))
+    routed = SabreSwap(coupling, heuristic='decay', seed=seed)(cx_circuit)
+
+    followed, previous_cx, column = _neighbouring_cx(qubits, is_cx)
+
+    # The routed CX, with SWAPs expanded; position[j] is the output index of the j-th original CX.
+    output = []
+    position = np.full(len(cx_gates), -1, dtype=np.int64)
+    last = [-1] * num_qubits
+    # owner[p] is the circuit qubit whose state is on physical qubit p, and the output CX of last[p] is
+    # open if nothing but CX follows it on p.
+    owner = list(range(num_qubits))
+    open_cx = [False] * num_qubits
+    swaps = 0
+    indices = {qubit: idx for idx, qubit in enumerate(routed.qubits)}
+    for instruction in routed.data:
+        physical_1, physical_2 = (indices[qubit] for qubit in instruction.qubits)
+        if instruction.operation.name == 'swap':
+            swaps += 1
+            previous = last[physical_1]
+            if previous >= 0 and output[previous] == (physical_2, physical_1):
+                physical_1, physical_2 = physical_2, physical_1
+            for pair in ((physical_1, physical_2), (physical_2, physical_1), (physical_1, physical_2)):
+                previous = last[pair[0]]
+                if previous >= 0 and previous == last[pair[1]] and output[previous] == pair \
+                        and open_cx[pair[0]] and open_cx[pair[1]]:
+                    output[previous] = None
+                    last[pair[0]] = last[pair[1]] = -1
+                    continue
+                last[pair[0]] = last[pair[1]] = len(output)
+                open_cx[pair[0]] = open_cx[pair[1]] = True
+                output.append(pair)
+            owner[physical_1], owner[physical_2] = owner[physical_2], owner[physical_1]
+        else:
+            idx = pending[owner[physical_1]].popleft()
+            pending[owner[physical_2]].popleft()
+            position[idx] = len(output)
+            last[physical_1] = last[physical_2] = len(output)
+            open_cx[physical_1], open_cx[physical_2] = not followed[idx, 0], not followed[idx, 1]
+            output.append((physical_1, physical_2))
+
+    # Every single-qubit gate goes right after the CX before it on its qubit (in order), or at the start.
+    single = np.flatnonzero(~is_cx)
+    output_qubits = np.array([pair if pair is not None else (-1, -1) for pair in output], dtype=np.int32)
+    output_qubits = output_qubits.reshape(-1, 2)
+    after = np.where(previous_cx >= 0, position[previous_cx], -1)
+    single_qubits = np.where(previous_cx >= 0, output_qubits[np.maximum(after, 0), column], qubits[single, 0])
+
+    alive = np.flatnonzero(output_qubits[:, 0] >= 0)
+    order = np.lexsort((np.concatenate([np.zeros(len(alive), dtype=np.int64), single]),
+                        np.concatenate([np.zeros(len(alive), dtype=np.int64), np.ones(len(single), dtype=np.int64)]),
+                        np.concatenate([alive, after])))
+    size = len(alive) + len(single)
+    routed_ops = np.concatenate([np.full(len(alive), OP_CX, dtype=np.uint8), ops[single]])[order]
+    routed_qubits = np.full((size, 3), -1, dtype=np.int32)
+    routed_qubits[:len(alive), :2] = output_qubits[alive]
+    routed_qubits[len(alive):, 0] = single_qubits
+    routed_params = np.zeros((size, 3), dtype=np.float64)
+    routed_params[len(alive):] = params[single]
+    gates = GateStream.from_arrays(routed_ops, routed_qubits[order], routed_params[order], num_qubits=num_qubits,
+                                   global_phase=physical_gates.global_phase, basis=physical_gates.basis)
+    permutation = [0] * num_qubits
+    for physical_qubit, qubit in enumerate(owner):
+        permutation[qubit] = physical_qubit
+    return gates, swaps, permutation
+
+
+# This function builds the n-qubit Toffoli of main.py (or the CCZ with toffoli=False) lowered into basis,
+# on qubits 0..n-1 and without routing.
+def build_logical(n, basis=IBM_BASIS, toffoli=True, error_budget=0.0, depth_vs_cx='cx'):
+    return build_toffoli(n, error_budget=error_budget, depth_vs_cx=depth_vs_cx, gates=GateStream(n, basis=basis),
+                         toffoli=toffoli)
+
+
+# This function compiles the n-qubit Toffoli of main.py (or the CCZ with toffoli=False) for a coupling map:
+# it places the n qubits on a long path of the map in the ordering whose CX are closest on it (the least total
+# distance between control and target), routes the circuit with sabre_route and returns the routed GateStream on
+# the physical qubits and a report with the SWAP overhead, the compile time and the initial and final layouts
+# (the circuit ends with logical qubit q on final_layout[q]).
+def compile_for_coupling(n, coupling_map, basis=IBM_BASIS, toffoli=True, error_budget=0.0, depth_vs_cx='cx',
+                         orderings=None, seed=0):
+    if basis is None:
+        raise ValueError('routing needs a basis, in which every gate acts on at most two qubits')
+    start = time.perf_counter()
+    neighbours = coupling_neighbours(coupling_map)
+    distances = coupling_distances(neighbours)
+    physical_qubits = placement_qubits(neighbours, distances, n)
+    logical_gates = build_logical(n, basis=basis, toffoli=toffoli, error_budget=error_budget, depth_vs_cx=depth_vs_cx)
+
+    cx_qubits = logical_gates.qubits[logical_gates.ops == OP_CX, :2]
+    distance_by_ordering = {}
+    best = None
+    for name in orderings or list(ORDERINGS):
+        layout = np.empty(n, dtype=np.int32)
+        layout[ORDERINGS[name](n)] = physical_qubits
+        distance_by_ordering[name] = int(distances[layout[cx_qubits[:, 0]], layout[cx_qubits[:, 1]]].sum())
+        if best is None or distance_by_ordering[name] < distance_by_ordering[best[0]]:
+            best = (name, layout)
+
+    name, layout = best
+    physical_gates = GateStream(len(neighbours), basis=basis)
+    physical_gates.extend(logical_gates, qubit_map=layout)
+    gates, swaps, permutation = sabre_route(physical_gates, qiskit_coupling_map(neighbours), seed=seed)
+    cx = gates.count_ops().get('cx', 0)
+    logical_cx = len(cx_qubits)
+    report = {'n': n, 'ordering': name, 'cx': cx, 'logical_cx': logical_cx, 'swap_cx': cx - logical_cx,
+              'swaps': swaps, 'distance_by_ordering': distance_by_ordering, 'total': len(gates),
+              'depth': gates.depth(), 'logical_depth': logical_gates.depth(),
+              'compile_time': time.perf_counter() - start, 'initial_layout': layout.tolist(),
+              'final_layout': [permutation[physical_qubit] for physical_qubit in layout.tolist()]}
+    return gates, report
+
+
+# This function routes the unrouted circuit with Qiskit's transpile() on the same coupling map and initial
+# layout, for comparison, and returns its CX count, depth and time, timed like compile_for_coupling from the
+# build of the circuit.
+def transpile_for_coupling(n, coupling_map, initial_layout, basis=IBM_BASIS, toffoli=True, error_budget=0.0,
+                           depth_vs_cx='cx', optimization_level=1):
+    from qiskit import transpile
+
+    start = time.perf_counter()
+    qc = build_logical(n, basis=basis, toffoli=toffoli, error_budget=error_budget,
+                       depth_vs_cx=depth_vs_cx).to_circuit()
+
+    coupling = qiskit_coupling_map(coupling_neighbours(coupling_map))
+    routed = transpile(qc, coupling_map=coupling, basis_gates=list(basis), initial_layout=initial_layout,
+                       optimization_level=optimization_level, seed_transpiler=0)
+    elapsed = time.perf_counter() - start
+    return {'cx': routed.count_ops().get('cx', 0), 'depth': routed.depth(), 'time': elapsed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile the n-qubit Toffoli built by Qulin for a coupling map.')
+    parser.add_argument('n_min', type=int)
+    parser.add_argument('n_max', type=int, nargs='?')
+    parser.add_argument('--coupling', choices=('line', 'heavy-hex'), default='line')
+    parser.add_argument('--rows', type=int, default=None, help='heavy-hex rows (default: enough for n)')
+    parser.add_argument('--columns', type=int, default=15, help='heavy-hex qubits per row')
+    parser.add_argument('--basis', choices=[name for name in BASES if BASES[name] is not None], default='ibm')
+    parser.add_argument('--error-budget', type=float, default=0.0)
+    parser.add_argument('--depth-vs-cx', choices=DEPTH_VS_CX_POLICIES, default='cx')
+    parser.add_argument('--transpile', action='store_true', help="also route with Qiskit's transpile() to compare")
+    args = parser.parse_args()
+    # Qiskit is imported up front, so that the first compile time leaves the import out.
+    import qiskit.transpiler.passes
+
+    for n in range(args.n_min, (args.n_min if args.n_max is None else args.n_max) + 1):
+        if args.coupling == 'line':
+            coupling_map = line_coupling_map(n)
+        else:
+            rows = args.rows or -(-n // args.columns) + 1
+            coupling_map = heavy_hex_coupling_map(rows, args.columns)
+
+        gates, report = compile_for_coupling(n, coupling_map, basis=BASES[args.basis], error_budget=args.error_budget,
+                                             depth_vs_cx=args.depth_vs_cx)
+        line = '%d %s swaps %d cx %d (%d + %d for routing) depth %d (%d unrouted) in %.2fs' % (
+            n, report['ordering'], report['swaps'], report['cx'], report['logical_cx'], report['swap_cx'],
+            report['depth'], report['logical_depth'], report['compile_time'])
+        if args.transpile:
+            reference = transpile_for_coupling(n, coupling_map, report['initial_layout'], basis=BASES[args.basis],
+                                               error_budget=args.error_budget, depth_vs_cx=args.depth_vs_cx)
+            line += ' | transpile cx %d depth %d in %.2fs' % (reference['cx'], reference['depth'], reference['time'])
+        print(line)
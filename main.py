@@ -1,35 +1,27 @@
 import math
 import sys
 
-from qiskit import QuantumCircuit
-
 from n_toffoli_decomp_utils import *
 
 # This main function implements our compilation scheme Qulin and counts the gates.
 n = 8 # for n in range(8, 34, 1):
-qr = QuantumRegister(n)
-qc = QuantumCircuit(qr)
-
-qc.append(HGate(), [qr[-1]])
-ccz_qulin_combined(qc, qr)
-qc.append(HGate(), [qr[-1]])
-
-qc = transpile(qc, basis_gates=['u1', 'u2', 'u3', 'cx'], optimization_level=0)  # IBM
+qr = list(range(n))
+gates = GateStream(n, basis=IBM_BASIS)  # IBM
 
-cx_cnt = 0
-total_cnt = 0
+gates.h(qr[-1])
+ccz_qulin_combined(gates, qr)
+gates.h(qr[-1])
 
-for gate in qc.data:
-    if 'cx' == gate.operation.name:
-        cx_cnt += 1
-    total_cnt += 1
+# The gates are counted on the GateStream itself, so Qiskit is not needed (nor imported) for the counts.
+print(gates.count_ops().get('cx', 0))
+print(len(gates))
+print(gates.depth())
 
-print(cx_cnt)
-print(total_cnt)
-print(qc.depth())
+'''import numpy as np
+from qiskit.quantum_info import Statevector
 
-'''state = Statevector.from_label('+' * n)
-state = state.evolve(qc).data
+state = Statevector.from_label('+' * n)
+state = state.evolve(gates.to_circuit()).data
 state -= state[0]
 state = np.round(state, 5)
 
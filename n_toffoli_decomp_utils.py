@@ -1,30 +1,91 @@
-from qiskit.circuit.library.standard_gates import *
 import math
-import numpy as np
-import sys
-from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
-from qiskit.quantum_info import Statevector
-from qiskit import transpile
-import time
-from qiskit.circuit.library import *
+
+from gate_stream import GateStream, CircuitSink, as_gate_sink, BASES, IBM_BASIS, RZ_SX_BASIS
+from template_cache import cached_template
+
+
+# The rotation angle ccz_qulin_combined passes to SmallQulin and Qulin.
+QULIN_THETA = 400001 * math.pi
+
+
+# The policies of ccz_qulin_combined for U_{+1}: 'cx' builds it as in Fig.18, 'depth' with
+# large_plus_1_gate_low_depth, which cuts the depth by about 40% (it stays linear). Despite the names, this is
+# no trade-off: 'depth' also uses about 20% fewer CX.
+DEPTH_VS_CX_POLICIES = ('cx', 'depth')
 
 
 # This function implements our compilation scheme Qulin.
-def ccz_qulin_combined(qc, operated_qubits):
+# With error_budget > 0 it drops controlled-phase blocks whose rotations are negligible (see ladder_thetas)
+# and returns the proven operator-norm distance from the exact circuit, which is 0 for error_budget=0.
+# depth_vs_cx selects the U_{+1} construction, one of DEPTH_VS_CX_POLICIES.
+def ccz_qulin_combined(qc, operated_qubits, error_budget=0.0, depth_vs_cx='cx'):
+    qc = as_gate_sink(qc)
     n = len(operated_qubits)
-    theta = 400001 * math.pi
+    theta = QULIN_THETA
+    if depth_vs_cx not in DEPTH_VS_CX_POLICIES:
+        raise ValueError('depth_vs_cx must be one of %s, not %r' % (', '.join(DEPTH_VS_CX_POLICIES), depth_vs_cx))
 
     # This implements SmallQulin for up to 22 qubits.
     if n <= 22:
-        ccz_smallqulin(qc=qc, operated_qubits=operated_qubits, theta=theta)
+        ccz_smallqulin(qc=qc, operated_qubits=operated_qubits, theta=theta, error_budget=error_budget,
+                       depth_vs_cx=depth_vs_cx)
 
     # This implements Qulin for 23 or more qubits.
     else:
-        ccz_qulin(qc=qc, operated_qubits=operated_qubits, theta=theta)
+        ccz_qulin(qc=qc, operated_qubits=operated_qubits, theta=theta, error_budget=error_budget,
+                  depth_vs_cx=depth_vs_cx)
+
+    return ladder_thetas(theta / 2, ladder_size(n), error_budget)[1]
+
+
+# This function returns the number of controls m of the first controlled-phase ladder of ccz_qulin_combined
+# on n qubits (the second has m + 1).
+def ladder_size(n):
+    if n <= 22 or n % 2 == 1:
+        return n - 3
+    return n - 2
+
+
+# This function returns the angles of the two controlled-phase ladders of ccz_qulin and ccz_smallqulin,
+# -theta / 2^k for the m controls of the first and theta / 2^k plus the V(1) term for the m + 1 controls
+# of the second, and the proven operator-norm error of dropping blocks.
+# Dropping C(U1(phi)) moves the circuit by |e^(i phi) - 1| = 2|sin(phi / 2)| in operator norm, and the errors
+# of several blocks add up at most, so the blocks are dropped cheapest first (their angle set to 0) while
+# the sum stays within error_budget.
+def ladder_thetas(theta, m, error_budget=0.0):
+    thetas = []
+    idx_theta = theta
+    for _ in range(m):
+        thetas.append(idx_theta)
+        idx_theta /= 2
+    ladders = [[- idx_theta for idx_theta in thetas], thetas + thetas[-1:]]
+
+    error_bound = 0.0
+    if error_budget > 0:
+        costs = sorted((2 * abs(math.sin(idx_theta / 2)), ladder, idx)
+                       for ladder, angles in enumerate(ladders) for idx, idx_theta in enumerate(angles))
+        for cost, ladder, idx in costs:
+            if error_bound + cost > error_budget:
+                break
+            ladders[ladder][idx] = 0.0
+            error_bound += cost
+    return ladders, error_bound
+
+
+# This function converts an average gate infidelity budget into the operator-norm budget of ccz_qulin_combined.
+# If ||U - V|| <= d, every eigenvalue of U^dagger V is within d of 1, so |Tr(U^dagger V)| / 2^n >= 1 - d^2 / 2
+# and the average infidelity is at most 1 - (1 - d^2 / 2)^2.
+def norm_budget_for_infidelity(infidelity):
+    return math.sqrt(2 * (1 - math.sqrt(1 - min(infidelity, 1.0))))
+
+
+def infidelity_bound(error_bound):
+    return 1 - max(1 - error_bound ** 2 / 2, 0.0) ** 2
 
 
 # This function implements our compilation scheme Qulin for 23 or more qubits.
-def ccz_qulin(qc, operated_qubits, theta):
+def ccz_qulin(qc, operated_qubits, theta, error_budget=0.0, depth_vs_cx='cx'):
+    qc = as_gate_sink(qc)
     n = len(operated_qubits)
 
     # This implements C^{n-1}(V) in Fig.7.
@@ -32,154 +93,237 @@ def ccz_qulin(qc, operated_qubits, theta):
 
         # This implements U^{n-1}_{+1} in Fig.7.
         large_increment_gate(qc=qc, operated_qubits=operated_qubits[:-1],
-                             ancilla_qubits=[operated_qubits[-1]], flag_add=True)
+                             ancilla_qubits=[operated_qubits[-1]], flag_add=True, depth_vs_cx=depth_vs_cx)
 
         # This implements U^{n-1}_{V_{n-1}}(-1) in Fig.7.
         theta /= 2
-        idx_theta = theta
-        for qubit in operated_qubits[1:-1][::-1]:
-            c_u1(qc=qc, theta=- idx_theta, operated_qubits=[qubit, operated_qubits[-1]])
-            idx_theta /= 2
+        ladders, _ = ladder_thetas(theta, n - 2, error_budget)
+        c_u1_ladder(qc=qc, thetas=ladders[0],
+                    control_qubits=operated_qubits[1:-1][::-1], target_qubits=operated_qubits[-1:])
 
         # This implements U^{n-1}_{-1} in Fig.7.
         large_increment_gate(qc=qc, operated_qubits=operated_qubits[:-1],
-                             ancilla_qubits=[operated_qubits[-1]], flag_add=False)
-
-        # This implements U^{n-1}_{V_{n-1}}(1) in Fig.7.
-        idx_theta = theta
-        for qubit in operated_qubits[1:-1][::-1]:
-            c_u1(qc=qc, theta=idx_theta, operated_qubits=[qubit, operated_qubits[-1]])
-            idx_theta /= 2
+                             ancilla_qubits=[operated_qubits[-1]], flag_add=False, depth_vs_cx=depth_vs_cx)
 
-        # This implements V_{n-1}(1) in Fig.7.
-        c_u1(qc=qc, theta=idx_theta * 2, operated_qubits=[operated_qubits[0], operated_qubits[-1]])
+        # This implements U^{n-1}_{V_{n-1}}(1) and V_{n-1}(1) in Fig.7.
+        c_u1_ladder(qc=qc, thetas=ladders[1],
+                    control_qubits=operated_qubits[1:-1][::-1] + operated_qubits[:1], target_qubits=operated_qubits[-1:])
 
     # This implements C^{n-1}(V) in Fig.8.
     else:
 
         # This implements U^{n-2}_{+1} in Fig.8.
         large_increment_gate(qc=qc, operated_qubits=operated_qubits[:-2],
-                             ancilla_qubits=operated_qubits[-2:], flag_add=True)
+                             ancilla_qubits=operated_qubits[-2:], flag_add=True, depth_vs_cx=depth_vs_cx)
 
         # This implements C(U^{n-2}_{V_{n-2}}(-1)) in Fig.8.
         theta /= 2
-        idx_theta = theta
-        for qubit in operated_qubits[1:-2][::-1]:
-            cc_u1(qc=qc, theta=- idx_theta, operated_qubits=[qubit] + operated_qubits[-2:])
-            idx_theta /= 2
+        ladders, _ = ladder_thetas(theta, n - 3, error_budget)
+        c_u1_ladder(qc=qc, thetas=ladders[0],
+                    control_qubits=operated_qubits[1:-2][::-1], target_qubits=operated_qubits[-2:])
 
         # This implements U^{n-2}_{-1} in Fig.8.
         large_increment_gate(qc=qc, operated_qubits=operated_qubits[:-2],
-                             ancilla_qubits=operated_qubits[-2:], flag_add=False)
+                             ancilla_qubits=operated_qubits[-2:], flag_add=False, depth_vs_cx=depth_vs_cx)
 
-        # This implements C(U^{n-2}_{V_{n-2}}(1)) in Fig.8.
-        idx_theta = theta
-        for qubit in operated_qubits[1:-2][::-1]:
-            cc_u1(qc=qc, theta=idx_theta, operated_qubits=[qubit] + operated_qubits[-2:])
-            idx_theta /= 2
-
-        # This implements C(V_{n-2}(1)) in Fig.8
-        cc_u1(qc=qc, theta=idx_theta * 2, operated_qubits=[operated_qubits[0]] + operated_qubits[-2:])
+        # This implements C(U^{n-2}_{V_{n-2}}(1)) and C(V_{n-2}(1)) in Fig.8.
+        c_u1_ladder(qc=qc, thetas=ladders[1],
+                    control_qubits=operated_qubits[1:-2][::-1] + operated_qubits[:1], target_qubits=operated_qubits[-2:])
 
 
 # This function implements U^{n-1}_{+1} and U^{n-1}_{-1} in Fig.5 and Fig.6.
-def large_increment_gate(qc, operated_qubits, ancilla_qubits, flag_add=True):
+# With depth_vs_cx='depth' the U_{+1} blocks are large_plus_1_gate_low_depth.
+def large_increment_gate(qc, operated_qubits, ancilla_qubits, flag_add=True, depth_vs_cx='cx'):
+    qc = as_gate_sink(qc)
+    plus_1_gate = large_plus_1_gate_low_depth if depth_vs_cx == 'depth' else large_plus_1_gate_w_enough_ancilla
     first_half_qubits = operated_qubits[:len(operated_qubits) // 2 + 1]
     second_half_qubits = operated_qubits[len(operated_qubits) // 2 + 1:]
 
     # This implements U^{n-1}_{-1} in Fig.5.
     if not flag_add:
         for qubit in operated_qubits:
-            qc.append(XGate(), [qubit])
+            qc.x(qubit)
 
     # This implements U^{k_2}_{+1} in Fig.6 by Eq.(6).
-    large_plus_1_gate_w_enough_ancilla(qc=qc, operated_qubits=[ancilla_qubits[0]] + second_half_qubits,
-                                       ancilla_qubits=first_half_qubits + ancilla_qubits[1:])
+    plus_1_gate(qc=qc, operated_qubits=[ancilla_qubits[0]] + second_half_qubits,
+                ancilla_qubits=first_half_qubits + ancilla_qubits[1:])
 
-    qc.append(XGate(), [ancilla_qubits[0]])
+    qc.x(ancilla_qubits[0])
 
     for qubit in second_half_qubits:
-        qc.append(CXGate(), [ancilla_qubits[0], qubit])
+        qc.cx(ancilla_qubits[0], qubit)
 
     # This implements C^{k_1}(X) in Fig.6 by Eq.(2).
     large_toffoli_w_enough_ancilla(qc=qc, operated_qubits=first_half_qubits + [ancilla_qubits[0]],
                                    ancilla_qubits=second_half_qubits)
 
     # This implements U^{k_2}_{+1} in Fig.6 by Eq.(6).
-    large_plus_1_gate_w_enough_ancilla(qc=qc, operated_qubits=[ancilla_qubits[0]] + second_half_qubits,
-                                       ancilla_qubits=first_half_qubits + ancilla_qubits[1:])
+    plus_1_gate(qc=qc, operated_qubits=[ancilla_qubits[0]] + second_half_qubits,
+                ancilla_qubits=first_half_qubits + ancilla_qubits[1:])
 
-    qc.append(XGate(), [ancilla_qubits[0]])
+    qc.x(ancilla_qubits[0])
 
     # This implements C^{k_1}(X) in Fig.6 by Eq.(2).
     large_toffoli_w_enough_ancilla(qc=qc, operated_qubits=first_half_qubits + [ancilla_qubits[0]],
                                    ancilla_qubits=second_half_qubits)
 
     for qubit in second_half_qubits:
-        qc.append(CXGate(), [ancilla_qubits[0], qubit])
+        qc.cx(ancilla_qubits[0], qubit)
 
     # This implements U^{k_1}_{+1} in Fig.6 by Eq.(6).
-    large_plus_1_gate_w_enough_ancilla(qc=qc, operated_qubits=first_half_qubits,
-                                       ancilla_qubits=second_half_qubits + ancilla_qubits)
+    plus_1_gate(qc=qc, operated_qubits=first_half_qubits,
+                ancilla_qubits=second_half_qubits + ancilla_qubits)
 
     # This implements U^{n-1}_{-1} in Fig.5.
     if not flag_add:
         for qubit in operated_qubits:
-            qc.append(XGate(), [qubit])
+            qc.x(qubit)
 
 
 # This function implements U^{n/2}_{+1} by Eq.(6) in Gn scheme as shown in Fig.18.
+@cached_template
 def large_plus_1_gate_w_enough_ancilla(qc, operated_qubits, ancilla_qubits):
-    qc.append(XGate(), [ancilla_qubits[0]])
+    qc = as_gate_sink(qc)
+    qc.x(ancilla_qubits[0])
     for qubit in operated_qubits:
-        qc.append(XGate().control(1), [ancilla_qubits[0], qubit])
-    qc.append(XGate(), [ancilla_qubits[0]])
+        qc.cx(ancilla_qubits[0], qubit)
+    qc.x(ancilla_qubits[0])
 
     # This implements U^{n}_{z+y+x} in Fig.19 and Fig.23.
-    for idx in range(len(operated_qubits) - 1):
-        ux_gate(qc=qc, operated_qubits=[ancilla_qubits[0], ancilla_qubits[idx + 1], operated_qubits[idx]])
-    qc.append(CXGate(), [ancilla_qubits[0], operated_qubits[-1]])
-    for idx in range(len(operated_qubits) - 2, -1, -1):
-        uz_gate(qc=qc, operated_qubits=[ancilla_qubits[0], ancilla_qubits[idx + 1], operated_qubits[idx]])
+    large_uzyx_gate(qc=qc, operated_qubits=operated_qubits, ancilla_qubits=ancilla_qubits[:len(operated_qubits)])
 
     for idx in range(len(operated_qubits) - 1):
-        qc.append(XGate(), [ancilla_qubits[idx + 1]])
+        qc.x(ancilla_qubits[idx + 1])
 
     # This implements U^{n}_{z+y+x} in Fig.19 and Fig.23.
-    for idx in range(len(operated_qubits) - 1):
-        ux_gate(qc=qc, operated_qubits=[ancilla_qubits[0], ancilla_qubits[idx + 1], operated_qubits[idx]])
-    qc.append(CXGate(), [ancilla_qubits[0], operated_qubits[-1]])
-    for idx in range(len(operated_qubits) - 2, -1, -1):
-        uz_gate(qc=qc, operated_qubits=[ancilla_qubits[0], ancilla_qubits[idx + 1], operated_qubits[idx]])
+    large_uzyx_gate(qc=qc, operated_qubits=operated_qubits, ancilla_qubits=ancilla_qubits[:len(operated_qubits)])
 
     for idx in range(len(operated_qubits) - 1):
-        qc.append(XGate(), [ancilla_qubits[idx + 1]])
+        qc.x(ancilla_qubits[idx + 1])
 
-    qc.append(XGate(), [operated_qubits[-1]])
+    qc.x(operated_qubits[-1])
 
-    qc.append(XGate(), [ancilla_qubits[0]])
+    qc.x(ancilla_qubits[0])
     for qubit in operated_qubits:
-        qc.append(XGate().control(1), [ancilla_qubits[0], qubit])
-    qc.append(XGate(), [ancilla_qubits[0]])
+        qc.cx(ancilla_qubits[0], qubit)
+    qc.x(ancilla_qubits[0])
+
+
+# This function implements U^{n}_{z+y+x} in Fig.19 and Fig.23 on the operated qubits, with ancilla_qubits[0]
+# and one more ancilla per operated qubit but the last. It is applied twice by large_plus_1_gate_w_enough_ancilla,
+# which is why it is a template of its own.
+@cached_template
+def large_uzyx_gate(qc, operated_qubits, ancilla_qubits):
+    qc = as_gate_sink(qc)
+    for idx in range(len(operated_qubits) - 1):
+        ux_gate(qc=qc, operated_qubits=[ancilla_qubits[0], ancilla_qubits[idx + 1], operated_qubits[idx]])
+    qc.cx(ancilla_qubits[0], operated_qubits[-1])
+    for idx in range(len(operated_qubits) - 2, -1, -1):
+        uz_gate(qc=qc, operated_qubits=[ancilla_qubits[0], ancilla_qubits[idx + 1], operated_qubits[idx]])
 
 
 # This function implements U^{3}_{x} in Fig.22.
 def ux_gate(qc, operated_qubits):
-    qc.append(CXGate(), [operated_qubits[0], operated_qubits[2]])
-    qc.append(CXGate(), [operated_qubits[0], operated_qubits[1]])
-    qc.append(CCXGate(), [operated_qubits[1], operated_qubits[2], operated_qubits[0]])
+    qc = as_gate_sink(qc)
+    qc.cx(operated_qubits[0], operated_qubits[2])
+    qc.cx(operated_qubits[0], operated_qubits[1])
+    qc.ccx(operated_qubits[1], operated_qubits[2], operated_qubits[0])
 
 # This function implements U^{3}_{z} in Fig.22.
 def uz_gate(qc, operated_qubits):
-    qc.append(CCXGate(), [operated_qubits[1], operated_qubits[2], operated_qubits[0]])
-    qc.append(CXGate(), [operated_qubits[0], operated_qubits[1]])
-    qc.append(CXGate(), [operated_qubits[1], operated_qubits[2]])
+    qc = as_gate_sink(qc)
+    qc.ccx(operated_qubits[1], operated_qubits[2], operated_qubits[0])
+    qc.cx(operated_qubits[0], operated_qubits[1])
+    qc.cx(operated_qubits[1], operated_qubits[2])
+
+
+# This function implements U^{k}_{+1} with k dirty ancillas g at about half the depth of
+# large_plus_1_gate_w_enough_ancilla, as x + 1 = x - g - NOT(g) = NOT(NOT(x) + g + NOT(g)) with two adders.
+# The adders do not run their carries through one ancilla, so their Toffoli gates come in pairs that
+# cancel their relative phases, and their CX chains are parallel prefixes of logarithmic depth.
+@cached_template
+def large_plus_1_gate_low_depth(qc, operated_qubits, ancilla_qubits):
+    qc = as_gate_sink(qc)
+    ancilla_qubits = ancilla_qubits[:len(operated_qubits)]
+
+    for qubit in operated_qubits:
+        qc.x(qubit)
+    large_add_gate(qc=qc, operated_qubits=operated_qubits, ancilla_qubits=ancilla_qubits)
+    for qubit in ancilla_qubits:
+        qc.x(qubit)
+    large_add_gate(qc=qc, operated_qubits=operated_qubits, ancilla_qubits=ancilla_qubits)
+    for qubit in ancilla_qubits:
+        qc.x(qubit)
+    for qubit in operated_qubits:
+        qc.x(qubit)
+
+
+# This function adds the register on ancilla_qubits to the one on operated_qubits modulo 2^k, restoring
+# ancilla_qubits, with the ripple-carry adder of Takahashi and Kunihiro that needs no extra qubit.
+# The carries ripple along ancilla_qubits: every Toffoli gate of the first ladder is undone by the same gate of
+# the second ladder and only read in between, so both are implemented by margolus_gate.
+@cached_template
+def large_add_gate(qc, operated_qubits, ancilla_qubits):
+    qc = as_gate_sink(qc)
+    n = len(operated_qubits)
+
+    for idx in range(1, n):
+        qc.cx(ancilla_qubits[idx], operated_qubits[idx])
+    prefix_xor_gate(qc=qc, operated_qubits=ancilla_qubits[1:], flag_inverse=True)
+
+    for idx in range(n - 1):
+        margolus_gate(qc=qc, operated_qubits=[ancilla_qubits[idx], operated_qubits[idx], ancilla_qubits[idx + 1]])
+    for idx in range(n - 1, 0, -1):
+        qc.cx(ancilla_qubits[idx], operated_qubits[idx])
+        margolus_gate(qc=qc, operated_qubits=[ancilla_qubits[idx - 1], operated_qubits[idx - 1], ancilla_qubits[idx]])
+
+    prefix_xor_gate(qc=qc, operated_qubits=ancilla_qubits[1:])
+    for idx in range(n):
+        qc.cx(ancilla_qubits[idx], operated_qubits[idx])
+
+
+# This function replaces every qubit by the XOR of itself and the qubits before it, or with flag_inverse=True
+# undoes it, with the parallel prefix of Brent and Kung: about 2k CX in depth 2 log k instead of a chain of k - 1.
+def prefix_xor_gate(qc, operated_qubits, flag_inverse=False):
+    qc = as_gate_sink(qc)
+    n = len(operated_qubits)
+    pairs = []
+    step = 1
+    while step < n:
+        pairs += [(idx - step, idx) for idx in range(2 * step - 1, n, 2 * step)]
+        step *= 2
+    step //= 2
+    while step >= 1:
+        pairs += [(idx - step, idx) for idx in range(3 * step - 1, n, 2 * step)]
+        step //= 2
+
+    for control, target in (pairs[::-1] if flag_inverse else pairs):
+        qc.cx(operated_qubits[control], operated_qubits[target])
+
+
+# This function implements C^2(X) up to a relative phase with 3 CX (Margolus), the same block as in
+# large_toffoli_w_enough_ancilla. It is its own inverse, and two of them around gates that leave the three
+# qubits unchanged make a Toffoli pair. operated_qubits[0] is the control read last.
+def margolus_gate(qc, operated_qubits):
+    qc = as_gate_sink(qc)
+    qc.ry(- math.pi / 4, operated_qubits[2])
+    qc.cx(operated_qubits[1], operated_qubits[2])
+    qc.ry(- math.pi / 4, operated_qubits[2])
+    qc.cx(operated_qubits[0], operated_qubits[2])
+    qc.ry(math.pi / 4, operated_qubits[2])
+    qc.cx(operated_qubits[1], operated_qubits[2])
+    qc.ry(math.pi / 4, operated_qubits[2])
 
 
 # This function implements C^{n/2}(X) by Eq.(2) in Iten scheme.
+@cached_template
 def large_toffoli_w_enough_ancilla(qc, operated_qubits, ancilla_qubits):
+    qc = as_gate_sink(qc)
     if len(operated_qubits) <= 3:
-        qc.append(XGate().control(len(operated_qubits) - 1), operated_qubits)
+        if len(operated_qubits) == 3:
+            qc.ccx(operated_qubits[0], operated_qubits[1], operated_qubits[2])
+        else:
+            qc.cx(operated_qubits[0], operated_qubits[1])
 
     else:
         toffoli_qubits = operated_qubits[:]
@@ -187,167 +331,218 @@ def large_toffoli_w_enough_ancilla(qc, operated_qubits, ancilla_qubits):
         for idx in range(len(operated_qubits) - 3):
             toffoli_qubits.insert(2 * (idx + 1), ancilla_qubits[idx])
 
-        qc.append(XGate().control(2), toffoli_qubits[len(toffoli_qubits) - 3:])
+        qc.ccx(*toffoli_qubits[len(toffoli_qubits) - 3:])
 
         for idx in list(range(len(toffoli_qubits) - 3, 1, -2))[1:]:
-            qc.append(RYGate(- math.pi / 4), [toffoli_qubits[idx + 2]])
-            qc.append(CXGate(), [toffoli_qubits[idx + 1], toffoli_qubits[idx + 2]])
-            qc.append(RYGate(- math.pi / 4), [toffoli_qubits[idx + 2]])
-            qc.append(CXGate(), [toffoli_qubits[idx + 0], toffoli_qubits[idx + 2]])
-
-        qc.append(RYGate(- math.pi / 4), [toffoli_qubits[2]])
-        qc.append(CXGate(), [toffoli_qubits[1], toffoli_qubits[2]])
-        qc.append(RYGate(- math.pi / 4), [toffoli_qubits[2]])
-        qc.append(CXGate(), [toffoli_qubits[0], toffoli_qubits[2]])
-        qc.append(RYGate(math.pi / 4), [toffoli_qubits[2]])
-        qc.append(CXGate(), [toffoli_qubits[1], toffoli_qubits[2]])
-        qc.append(RYGate(math.pi / 4), [toffoli_qubits[2]])
+            qc.ry(- math.pi / 4, toffoli_qubits[idx + 2])
+            qc.cx(toffoli_qubits[idx + 1], toffoli_qubits[idx + 2])
+            qc.ry(- math.pi / 4, toffoli_qubits[idx + 2])
+            qc.cx(toffoli_qubits[idx + 0], toffoli_qubits[idx + 2])
+
+        qc.ry(- math.pi / 4, toffoli_qubits[2])
+        qc.cx(toffoli_qubits[1], toffoli_qubits[2])
+        qc.ry(- math.pi / 4, toffoli_qubits[2])
+        qc.cx(toffoli_qubits[0], toffoli_qubits[2])
+        qc.ry(math.pi / 4, toffoli_qubits[2])
+        qc.cx(toffoli_qubits[1], toffoli_qubits[2])
+        qc.ry(math.pi / 4, toffoli_qubits[2])
 
         for idx in list(range(0, len(toffoli_qubits) - 4, 2))[1:]:
-            qc.append(CXGate(), [toffoli_qubits[idx + 0], toffoli_qubits[idx + 2]])
-            qc.append(RYGate(math.pi / 4), [toffoli_qubits[idx + 2]])
-            qc.append(CXGate(), [toffoli_qubits[idx + 1], toffoli_qubits[idx + 2]])
-            qc.append(RYGate(math.pi / 4), [toffoli_qubits[idx + 2]])
+            qc.cx(toffoli_qubits[idx + 0], toffoli_qubits[idx + 2])
+            qc.ry(math.pi / 4, toffoli_qubits[idx + 2])
+            qc.cx(toffoli_qubits[idx + 1], toffoli_qubits[idx + 2])
+            qc.ry(math.pi / 4, toffoli_qubits[idx + 2])
 
-        qc.append(XGate().control(2), toffoli_qubits[len(toffoli_qubits) - 3:])
+        qc.ccx(*toffoli_qubits[len(toffoli_qubits) - 3:])
 
         for idx in list(range(len(toffoli_qubits) - 3, 1, -2))[1:]:
-            qc.append(RYGate(- math.pi / 4), [toffoli_qubits[idx + 2]])
-            qc.append(CXGate(), [toffoli_qubits[idx + 1], toffoli_qubits[idx + 2]])
-            qc.append(RYGate(- math.pi / 4), [toffoli_qubits[idx + 2]])
-            qc.append(CXGate(), [toffoli_qubits[idx + 0], toffoli_qubits[idx + 2]])
-
-        qc.append(RYGate(- math.pi / 4), [toffoli_qubits[2]])
-        qc.append(CXGate(), [toffoli_qubits[1], toffoli_qubits[2]])
-        qc.append(RYGate(- math.pi / 4), [toffoli_qubits[2]])
-        qc.append(CXGate(), [toffoli_qubits[0], toffoli_qubits[2]])
-        qc.append(RYGate(math.pi / 4), [toffoli_qubits[2]])
-        qc.append(CXGate(), [toffoli_qubits[1], toffoli_qubits[2]])
-        qc.append(RYGate(math.pi / 4), [toffoli_qubits[2]])
+            qc.ry(- math.pi / 4, toffoli_qubits[idx + 2])
+            qc.cx(toffoli_qubits[idx + 1], toffoli_qubits[idx + 2])
+            qc.ry(- math.pi / 4, toffoli_qubits[idx + 2])
+            qc.cx(toffoli_qubits[idx + 0], toffoli_qubits[idx + 2])
+
+        qc.ry(- math.pi / 4, toffoli_qubits[2])
+        qc.cx(toffoli_qubits[1], toffoli_qubits[2])
+        qc.ry(- math.pi / 4, toffoli_qubits[2])
+        qc.cx(toffoli_qubits[0], toffoli_qubits[2])
+        qc.ry(math.pi / 4, toffoli_qubits[2])
+        qc.cx(toffoli_qubits[1], toffoli_qubits[2])
+        qc.ry(math.pi / 4, toffoli_qubits[2])
 
         for idx in list(range(0, len(toffoli_qubits) - 4, 2))[1:]:
-            qc.append(CXGate(), [toffoli_qubits[idx + 0], toffoli_qubits[idx + 2]])
-            qc.append(RYGate(math.pi / 4), [toffoli_qubits[idx + 2]])
-            qc.append(CXGate(), [toffoli_qubits[idx + 1], toffoli_qubits[idx + 2]])
-            qc.append(RYGate(math.pi / 4), [toffoli_qubits[idx + 2]])
+            qc.cx(toffoli_qubits[idx + 0], toffoli_qubits[idx + 2])
+            qc.ry(math.pi / 4, toffoli_qubits[idx + 2])
+            qc.cx(toffoli_qubits[idx + 1], toffoli_qubits[idx + 2])
+            qc.ry(math.pi / 4, toffoli_qubits[idx + 2])
 
 
 # This function implements C(U^{1}_{diag}) by Eq.(3) in Shende and Markov scheme.
 def c_u1(qc, theta, operated_qubits):
-    qc.append(U1Gate(theta / 2), [operated_qubits[0]])
+    qc = as_gate_sink(qc)
+    qc.u1(theta / 2, operated_qubits[0])
 
-    qc.append(U1Gate(theta / 2), [operated_qubits[1]])
+    qc.u1(theta / 2, operated_qubits[1])
 
-    qc.append(CXGate(), operated_qubits)
+    qc.cx(operated_qubits[0], operated_qubits[1])
 
-    qc.append(U1Gate(- theta / 2), [operated_qubits[1]])
+    qc.u1(- theta / 2, operated_qubits[1])
 
-    qc.append(CXGate(), operated_qubits)
+    qc.cx(operated_qubits[0], operated_qubits[1])
 
 
 # This function implements C(U^{2}_{diag}) by Eq.(4) in Shende and Markov scheme.
 def cc_u1(qc, theta, operated_qubits):
-    qc.append(CXGate(), [operated_qubits[0], operated_qubits[2]])
+    qc = as_gate_sink(qc)
+    qc.cx(operated_qubits[0], operated_qubits[2])
 
-    qc.append(U1Gate(- theta / 4), [operated_qubits[2]])
+    qc.u1(- theta / 4, operated_qubits[2])
 
-    qc.append(CXGate(), [operated_qubits[1], operated_qubits[2]])
+    qc.cx(operated_qubits[1], operated_qubits[2])
 
-    qc.append(U1Gate(theta / 4), [operated_qubits[2]])
+    qc.u1(theta / 4, operated_qubits[2])
 
-    qc.append(CXGate(), [operated_qubits[0], operated_qubits[2]])
+    qc.cx(operated_qubits[0], operated_qubits[2])
 
-    qc.append(U1Gate(- theta / 4), [operated_qubits[2]])
+    qc.u1(- theta / 4, operated_qubits[2])
 
-    qc.append(CXGate(), [operated_qubits[1], operated_qubits[2]])
+    qc.cx(operated_qubits[1], operated_qubits[2])
 
-    qc.append(U1Gate(theta / 4), [operated_qubits[2]])
+    qc.u1(theta / 4, operated_qubits[2])
 
     c_u1(qc=qc, theta=theta / 2, operated_qubits=operated_qubits[:-1])
 
 
+# This function implements the product over k of C^{t}(U1(thetas[k])) controlled by control_qubits[k] and
+# the t target_qubits, i.e. a ladder of c_u1 (t = 1) or cc_u1 (t = 2), as one phase polynomial over the parities
+# of its qubits. Every control_qubits[k] walks the parities with target_qubits in Gray-code order, 2^t CX in all,
+# and the parities of target_qubits alone, which all the controls share, are applied once. Controls with
+# a zero angle are skipped.
+# A ladder of m cc_u1 takes 4m + 2 CX instead of 6m.
+def c_u1_ladder(qc, thetas, control_qubits, target_qubits):
+    qc = as_gate_sink(qc)
+    t = len(target_qubits)
+
+    # By x_1 x_2 ... x_s = sum over the non-empty subsets A of (-1)^(|A| + 1) (XOR of x_i in A) / 2^(s - 1),
+    # the parity of control k and targets in mask has the angle sign * thetas[k] / 2^t.
+    def sign(mask):
+        return 1 if bin(mask).count('1') % 2 == 0 else - 1
+
+    shared = [0.0] * (1 << t)
+    for idx_theta, qubit in zip(thetas, control_qubits):
+        if idx_theta == 0:
+            continue
+        mask = 0
+        qc.u1(idx_theta / 2 ** t, qubit)
+        for step in range(1, 1 << t):
+            bit = (step & - step).bit_length() - 1
+            qc.cx(target_qubits[bit], qubit)
+            mask ^= 1 << bit
+            qc.u1(sign(mask) * idx_theta / 2 ** t, qubit)
+            shared[mask] -= sign(mask) * idx_theta / 2 ** t
+        qc.cx(target_qubits[t - 1], qubit)
+
+    if not any(thetas):
+        return
+
+    # The parities of the targets alone, the one of the highest target on its own qubit first.
+    for top in range(t - 1, - 1, - 1):
+        mask = 1 << top
+        qc.u1(shared[mask], target_qubits[top])
+        for step in range(1, 1 << top):
+            bit = (step & - step).bit_length() - 1
+            qc.cx(target_qubits[bit], target_qubits[top])
+            mask ^= 1 << bit
+            qc.u1(shared[mask], target_qubits[top])
+        if top:
+            qc.cx(target_qubits[top - 1], target_qubits[top])
+
+
 # This function implements our compilation scheme SmallQulin for up to 22 qubits in Fig.8.
-def ccz_smallqulin(qc, operated_qubits, theta):
+def ccz_smallqulin(qc, operated_qubits, theta, error_budget=0.0, depth_vs_cx='cx'):
+    qc = as_gate_sink(qc)
 
     # This implements U^{n-2}_{+1} in SmallQulin.
     large_increment_gate_smallqulin(qc=qc, operated_qubits=operated_qubits[:-2],
-                                    ancilla_qubits=operated_qubits[-2:], flag_add=True)
+                                    ancilla_qubits=operated_qubits[-2:], flag_add=True, depth_vs_cx=depth_vs_cx)
 
     theta /= 2
-    idx_theta = theta
-    for qubit in operated_qubits[1:-2][::-1]:
-        cc_u1(qc=qc, theta=- idx_theta, operated_qubits=[qubit] + operated_qubits[-2:])
-        idx_theta /= 2
+    ladders, _ = ladder_thetas(theta, len(operated_qubits) - 3, error_budget)
+    c_u1_ladder(qc=qc, thetas=ladders[0],
+                control_qubits=operated_qubits[1:-2][::-1], target_qubits=operated_qubits[-2:])
 
     # This implements U^{n-2}_{-1} in SmallQulin.
     large_increment_gate_smallqulin(qc=qc, operated_qubits=operated_qubits[:-2],
-                                    ancilla_qubits=operated_qubits[-2:], flag_add=False)
-
-    idx_theta = theta
-    for qubit in operated_qubits[1:-2][::-1]:
-        cc_u1(qc=qc, theta=idx_theta, operated_qubits=[qubit] + operated_qubits[-2:])
-        idx_theta /= 2
+                                    ancilla_qubits=operated_qubits[-2:], flag_add=False, depth_vs_cx=depth_vs_cx)
 
-    cc_u1(qc=qc, theta=idx_theta * 2, operated_qubits=[operated_qubits[0]] + operated_qubits[-2:])
+    c_u1_ladder(qc=qc, thetas=ladders[1],
+                control_qubits=operated_qubits[1:-2][::-1] + operated_qubits[:1], target_qubits=operated_qubits[-2:])
 
 
 # This function implements U^{n-2}_{+1} and U^{n-2}_{-1} in SmallQulin in Fig.6.
-def large_increment_gate_smallqulin(qc, operated_qubits, ancilla_qubits, flag_add=True):
+def large_increment_gate_smallqulin(qc, operated_qubits, ancilla_qubits, flag_add=True, depth_vs_cx='cx'):
+    qc = as_gate_sink(qc)
     first_half_qubits = operated_qubits[:len(operated_qubits) // 2 + 1]
     second_half_qubits = operated_qubits[len(operated_qubits) // 2 + 1:]
 
     if not flag_add:
         for qubit in operated_qubits:
-            qc.append(XGate(), [qubit])
+            qc.x(qubit)
 
     large_increment_gate_smallqulin_w_ancilla(qc=qc, operated_qubits=[ancilla_qubits[0]] + second_half_qubits,
-                                           ancilla_qubits=first_half_qubits + ancilla_qubits[1:])
+                                           ancilla_qubits=first_half_qubits + ancilla_qubits[1:],
+                                           depth_vs_cx=depth_vs_cx)
 
-    qc.append(XGate(), [ancilla_qubits[0]])
+    qc.x(ancilla_qubits[0])
 
     for qubit in second_half_qubits:
-        qc.append(CXGate(), [ancilla_qubits[0], qubit])
+        qc.cx(ancilla_qubits[0], qubit)
 
     # This implements C^{k_1}(R_z) if 8 <= n <= 19
     if len(first_half_qubits) < 10:
-        qc.append(HGate(), [ancilla_qubits[0]])
+        qc.h(ancilla_qubits[0])
         large_rz_8_CX(qc=qc, operated_qubits=first_half_qubits + [ancilla_qubits[0]], theta=math.pi / 2)
-        qc.append(HGate(), [ancilla_qubits[0]])
+        qc.h(ancilla_qubits[0])
     else:
         large_toffoli_w_enough_ancilla(qc=qc, operated_qubits=first_half_qubits + [ancilla_qubits[0]],
                                        ancilla_qubits=second_half_qubits + ancilla_qubits[1:])
 
     large_increment_gate_smallqulin_w_ancilla(qc=qc, operated_qubits=[ancilla_qubits[0]] + second_half_qubits,
-                                           ancilla_qubits=first_half_qubits + ancilla_qubits[1:])
+                                           ancilla_qubits=first_half_qubits + ancilla_qubits[1:],
+                                           depth_vs_cx=depth_vs_cx)
 
-    qc.append(XGate(), [ancilla_qubits[0]])
+    qc.x(ancilla_qubits[0])
 
     # This implements C^{k_1}(R_z) if 8 <= n <= 19
     if len(first_half_qubits) < 10:
-        qc.append(HGate(), [ancilla_qubits[0]])
+        qc.h(ancilla_qubits[0])
         large_rz_8_CX(qc=qc, operated_qubits=first_half_qubits + [ancilla_qubits[0]], theta=- math.pi / 2)
-        qc.append(HGate(), [ancilla_qubits[0]])
+        qc.h(ancilla_qubits[0])
     else:
         large_toffoli_w_enough_ancilla(qc=qc, operated_qubits=first_half_qubits + [ancilla_qubits[0]],
                                        ancilla_qubits=second_half_qubits + ancilla_qubits[1:])
 
     for qubit in second_half_qubits:
-        qc.append(CXGate(), [ancilla_qubits[0], qubit])
+        qc.cx(ancilla_qubits[0], qubit)
 
     large_increment_gate_smallqulin_w_ancilla(qc=qc, operated_qubits=first_half_qubits,
-                                           ancilla_qubits=second_half_qubits + ancilla_qubits)
+                                           ancilla_qubits=second_half_qubits + ancilla_qubits,
+                                           depth_vs_cx=depth_vs_cx)
 
     if not flag_add:
         for qubit in operated_qubits:
-            qc.append(XGate(), [qubit])
+            qc.x(qubit)
 
 
 # This function implements U^{k}_{+1} in SmallQulin scheme.
-def large_increment_gate_smallqulin_w_ancilla(qc, operated_qubits, ancilla_qubits):
+@cached_template
+def large_increment_gate_smallqulin_w_ancilla(qc, operated_qubits, ancilla_qubits, depth_vs_cx='cx'):
+    qc = as_gate_sink(qc)
     n = len(operated_qubits)
 
     # This implements U^{k}_{+1} in Gn scheme if n >= 11.
-    if n >= 11:
+    if n >= 11 and depth_vs_cx == 'depth':
+        large_plus_1_gate_low_depth(qc=qc, operated_qubits=operated_qubits, ancilla_qubits=ancilla_qubits)
+    elif n >= 11:
         large_plus_1_gate_w_enough_ancilla(qc=qc, operated_qubits=operated_qubits, ancilla_qubits=ancilla_qubits)
 
     # This implements U^{k}_{+1} in SmallQulin scheme if n < 11.
@@ -356,61 +551,64 @@ def large_increment_gate_smallqulin_w_ancilla(qc, operated_qubits, ancilla_qubit
             large_toffoli_w_enough_ancilla(qc=qc, operated_qubits=operated_qubits[:idx], ancilla_qubits=ancilla_qubits)
 
         if n >= 4:
-            qc.append(HGate(), [operated_qubits[3]])
+            qc.h(operated_qubits[3])
             ccc_u1(qc=qc, theta=math.pi, operated_qubits=operated_qubits[:4])
-            qc.append(HGate(), [operated_qubits[3]])
+            qc.h(operated_qubits[3])
 
         if n >= 3:
-            qc.append(HGate(), [operated_qubits[2]])
+            qc.h(operated_qubits[2])
             cc_u1(qc=qc, theta=math.pi, operated_qubits=operated_qubits[:3])
-            qc.append(HGate(), [operated_qubits[2]])
+            qc.h(operated_qubits[2])
 
-        qc.append(CXGate(), operated_qubits[:2])
-        qc.append(XGate(), [operated_qubits[0]])
+        qc.cx(operated_qubits[0], operated_qubits[1])
+        qc.x(operated_qubits[0])
 
 
 # This function implements C^3(U^1_{diag}) needed in C^3(X) in SmallQulin scheme.
 def ccc_u1(qc, theta, operated_qubits):
-    qc.append(U1Gate(theta / 8), [operated_qubits[-1]])
-    qc.append(CXGate(), [operated_qubits[1], operated_qubits[3]])
+    qc = as_gate_sink(qc)
+    qc.u1(theta / 8, operated_qubits[-1])
+    qc.cx(operated_qubits[1], operated_qubits[3])
 
-    qc.append(U1Gate(-theta / 8), [operated_qubits[-1]])
-    qc.append(CXGate(), [operated_qubits[0], operated_qubits[3]])
+    qc.u1(-theta / 8, operated_qubits[-1])
+    qc.cx(operated_qubits[0], operated_qubits[3])
 
-    qc.append(U1Gate(theta / 8), [operated_qubits[-1]])
-    qc.append(CXGate(), [operated_qubits[1], operated_qubits[3]])
+    qc.u1(theta / 8, operated_qubits[-1])
+    qc.cx(operated_qubits[1], operated_qubits[3])
 
-    qc.append(U1Gate(-theta / 8), [operated_qubits[-1]])
-    qc.append(CXGate(), [operated_qubits[2], operated_qubits[3]])
+    qc.u1(-theta / 8, operated_qubits[-1])
+    qc.cx(operated_qubits[2], operated_qubits[3])
 
-    qc.append(U1Gate(theta / 8), [operated_qubits[-1]])
-    qc.append(CXGate(), [operated_qubits[1], operated_qubits[3]])
+    qc.u1(theta / 8, operated_qubits[-1])
+    qc.cx(operated_qubits[1], operated_qubits[3])
 
-    qc.append(U1Gate(-theta / 8), [operated_qubits[-1]])
-    qc.append(CXGate(), [operated_qubits[0], operated_qubits[3]])
+    qc.u1(-theta / 8, operated_qubits[-1])
+    qc.cx(operated_qubits[0], operated_qubits[3])
 
-    qc.append(U1Gate(theta / 8), [operated_qubits[-1]])
-    qc.append(CXGate(), [operated_qubits[1], operated_qubits[3]])
+    qc.u1(theta / 8, operated_qubits[-1])
+    qc.cx(operated_qubits[1], operated_qubits[3])
 
-    qc.append(U1Gate(-theta / 8), [operated_qubits[-1]])
-    qc.append(CXGate(), [operated_qubits[2], operated_qubits[3]])
+    qc.u1(-theta / 8, operated_qubits[-1])
+    qc.cx(operated_qubits[2], operated_qubits[3])
 
     cc_u1(qc=qc, theta=theta / 2, operated_qubits=operated_qubits[:-1])
 
 
 # This function implements C^{k_1}(R_z) in SmallQulin scheme.
+@cached_template
 def large_rz_8_CX(qc, operated_qubits, theta):
+    qc = as_gate_sink(qc)
 
     # This function implements C^{2}(R_z) in Shende and Markov scheme.
     if len(operated_qubits) == 3:
-        qc.append(CXGate(), [operated_qubits[0], operated_qubits[2]])
-        qc.append(U1Gate(- theta / 2), [operated_qubits[2]])
-        qc.append(CXGate(), [operated_qubits[1], operated_qubits[2]])
-        qc.append(U1Gate(theta / 2), [operated_qubits[2]])
-        qc.append(CXGate(), [operated_qubits[0], operated_qubits[2]])
-        qc.append(U1Gate(- theta / 2), [operated_qubits[2]])
-        qc.append(CXGate(), [operated_qubits[1], operated_qubits[2]])
-        qc.append(U1Gate(theta / 2), [operated_qubits[2]])
+        qc.cx(operated_qubits[0], operated_qubits[2])
+        qc.u1(- theta / 2, operated_qubits[2])
+        qc.cx(operated_qubits[1], operated_qubits[2])
+        qc.u1(theta / 2, operated_qubits[2])
+        qc.cx(operated_qubits[0], operated_qubits[2])
+        qc.u1(- theta / 2, operated_qubits[2])
+        qc.cx(operated_qubits[1], operated_qubits[2])
+        qc.u1(theta / 2, operated_qubits[2])
 
     # This function implements C^{n-1}(R_z) in SmallQulin scheme when n >= 4.
     else:
@@ -423,39 +621,41 @@ def large_rz_8_CX(qc, operated_qubits, theta):
         qubit_list_2nd = operated_qubits[qubit_1st: qubit_1st + qubit_2nd] + [operated_qubits[-1]]
         qubit_list_3rd = operated_qubits[qubit_1st + qubit_2nd: -1] + [operated_qubits[-1]]
 
-        qc.append(U1Gate(theta / 4), [operated_qubits[-1]])
+        qc.u1(theta / 4, operated_qubits[-1])
         large_toffoli_8_CX(qc=qc, operated_qubits=qubit_list_3rd, theta=math.pi / 2)
 
-        qc.append(U1Gate(-theta / 4), [operated_qubits[-1]])
+        qc.u1(-theta / 4, operated_qubits[-1])
         large_toffoli_8_CX(qc=qc, operated_qubits=qubit_list_2nd, theta=math.pi / 2)
 
-        qc.append(U1Gate(theta / 4), [operated_qubits[-1]])
+        qc.u1(theta / 4, operated_qubits[-1])
         large_toffoli_8_CX(qc=qc, operated_qubits=qubit_list_3rd, theta=math.pi / 2)
 
-        qc.append(U1Gate(-theta / 4), [operated_qubits[-1]])
+        qc.u1(-theta / 4, operated_qubits[-1])
         large_toffoli_8_CX(qc=qc, operated_qubits=qubit_list_1st, theta=math.pi / 2)
 
-        qc.append(U1Gate(theta / 4), [operated_qubits[-1]])
+        qc.u1(theta / 4, operated_qubits[-1])
         large_toffoli_8_CX(qc=qc, operated_qubits=qubit_list_3rd, theta=- math.pi / 2)
 
-        qc.append(U1Gate(-theta / 4), [operated_qubits[-1]])
+        qc.u1(-theta / 4, operated_qubits[-1])
         large_toffoli_8_CX(qc=qc, operated_qubits=qubit_list_2nd, theta=- math.pi / 2)
 
-        qc.append(U1Gate(theta / 4), [operated_qubits[-1]])
+        qc.u1(theta / 4, operated_qubits[-1])
         large_toffoli_8_CX(qc=qc, operated_qubits=qubit_list_3rd, theta=- math.pi / 2)
 
-        qc.append(U1Gate(-theta / 4), [operated_qubits[-1]])
+        qc.u1(-theta / 4, operated_qubits[-1])
         large_toffoli_8_CX(qc=qc, operated_qubits=qubit_list_1st, theta=- math.pi / 2)
 
 
 #This function iteratively implements C^{n-1}(R_z) in SmallQulin scheme.
+@cached_template
 def large_toffoli_8_CX(qc, operated_qubits, theta):
+    qc = as_gate_sink(qc)
     if len(operated_qubits) > 2:
-        qc.append(HGate(), [operated_qubits[-1]])
+        qc.h(operated_qubits[-1])
         large_rz_8_CX(qc=qc, operated_qubits=operated_qubits, theta=theta)
-        qc.append(HGate(), [operated_qubits[-1]])
+        qc.h(operated_qubits[-1])
     else:
-        qc.append(CXGate(), operated_qubits)
+        qc.cx(operated_qubits[0], operated_qubits[1])
 
 
 
@@ -0,0 +1,182 @@
+import argparse
+import math
+import mmap
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import n_toffoli_decomp_utils
+from gate_stream import GateSink, GateStream, BASES
+from resource_estimator import count_call
+from sweep import VARIANTS, build_toffoli
+from template_cache import template_key, clear_template_cache
+
+
+# This class is a gate sink that only counts the gates emitted into it. The cached functions called on it are
+# counted once per template key and then looked up in counts, which is shared by every sink of a plan.
+class _CountSink(GateSink):
+    def __init__(self, basis, counts):
+        super().__init__(basis)
+        self.counts = counts
+        self.size = 0
+
+    def emit(self, op, qubits, params=(0.0, 0.0, 0.0)):
+        self.size += 1
+
+    def count(self, function, arguments):
+        key, _ = template_key(function, self.basis, arguments)
+        counted = self.counts.get(key)
+        if counted is None:
+            sink = _CountSink(self.basis, self.counts)
+            function(sink, **{name: value for name, value in arguments.items() if name != 'qc'})
+            counted = self.counts[key] = sink.size
+        return counted
+
+    def apply_template(self, function, arguments):
+        self.size += self.count(function, arguments)
+
+
+# This class is a gate stream that plans a build: it stores the gates emitted directly by the top-level
+# functions (the X runs, the CX fan-outs and the controlled-phase ladders) and, in place of every top-level call
+# of a cached function, records a segment (its position among the stored gates, the function, its arguments
+# and its number of gates) without building it. The number of gates comes from the closed forms of
+# resource_estimator.py, or from walking the call into a _CountSink where there is none (Clifford+T).
+class _PlanStream(GateStream):
+    def __init__(self, num_qubits, basis):
+        super().__init__(num_qubits, basis=basis)
+        self.counter = _CountSink(basis, {})
+        self.segments = []
+
+    def apply_template(self, function, arguments):
+        arguments = {name: value for name, value in arguments.items() if name != 'qc'}
+        size = count_call(function.__name__, arguments, self.basis)
+        if size is None:
+            size = self.counter.count(function, arguments)
+        self.segments.append((len(self), function.__name__, arguments, size))
+
+
+# This function returns the plan of a build: a _PlanStream with the directly emitted gates and the segments.
+def plan_segments(n, variant='combined', basis='ibm', error_budget=0.0, depth_vs_cx='cx'):
+    plan = _PlanStream(n, BASES[basis])
+    return build_toffoli(n, variant=variant, error_budget=error_budget, depth_vs_cx=depth_vs_cx, gates=plan)
+
+
+# The output arrays and the basis of the build in progress, inherited by the forked worker processes.
+_output = None
+
+
+# This function builds one segment in place, into the gates start to start + size of the output arrays, and
+# returns its global phase. The template cache of the process is used as usual, so every template is built
+# once per process.
+def build_segment(start, name, arguments, size):
+    ops, qubits, params, num_qubits, basis = _output
+    end = start + size
+    segment = GateStream.from_arrays(ops[start:end], qubits[start:end], params[start:end], num_qubits=num_qubits,
+                                     basis=basis, copy=False, size=0)
+    getattr(n_toffoli_decomp_utils, name)(segment, **arguments)
+    if len(segment.ops) != size:
+        raise RuntimeError('%s emitted %d gates, %d were planned' % (name, len(segment.ops), size))
+    return segment.global_phase
+
+
+# This function builds the n-qubit Toffoli of sweep.build_toffoli with its top-level segments (the U_{+1} and
+# Toffoli blocks of both increment gates) generated concurrently in jobs forked worker processes (all CPUs by
+# default; with one CPU, or where processes cannot be forked, the segments are built here in turn). The build
+# is planned first, which fixes the offset of every segment, so the workers write their segments straight into
+# one preallocated shared stream while this process copies the directly emitted gates (X runs, fan-outs and
+# ladders) between them. The result is the serial build, gate for gate (the global phase is added up in
+# another order, so it may differ in the last bits).
+def parallel_build(n, variant='combined', basis='ibm', error_budget=0.0, depth_vs_cx='cx', jobs=None):
+    global _output
+    plan = plan_segments(n, variant=variant, basis=basis, error_budget=error_budget, depth_vs_cx=depth_vs_cx)
+    segments = plan.segments
+    size = len(plan) + sum(segment[3] for segment in segments)
+
+    jobs = os.cpu_count() if jobs is None else jobs
+    parallel = jobs > 1 and len(segments) > 1 and 'fork' in multiprocessing.get_all_start_methods()
+    if parallel:
+        # An anonymous shared mapping, which the forked workers write into; params first for alignment.
+        buffer = mmap.mmap(-1, max(37 * size, 1))
+        params = np.frombuffer(buffer, dtype=np.float64, count=3 * size).reshape(size, 3)
+        qubits = np.frombuffer(buffer, dtype=np.int32, count=3 * size, offset=24 * size).reshape(size, 3)
+        ops = np.frombuffer(buffer, dtype=np.uint8, count=size, offset=36 * size)
+    else:
+        ops = np.empty(size, dtype=np.uint8)
+        qubits = np.empty((size, 3), dtype=np.int32)
+        params = np.empty((size, 3), dtype=np.float64)
+    _output = (ops, qubits, params, n, plan.basis)
+
+    # The offset of every segment in the output, and the runs of directly emitted gates around them.
+    tasks = []
+    runs = []
+    position = offset = 0
+    for segment_position, name, arguments, segment_size in segments:
+        runs.append((position, segment_position, offset))
+        offset += segment_position - position
+        tasks.append((offset, name, arguments, segment_size))
+        position = segment_position
+        offset += segment_size
+    runs.append((position, len(plan), offset))
+
+    try:
+        if parallel:
+            # Largest first, so that the longest segments do not start last.
+            with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('fork')) as executor:
+                futures = [executor.submit(build_segment, *task)
+                           for task in sorted(tasks, key=lambda task: -task[3])]
+                plan_ops, plan_qubits, plan_params = plan.ops, plan.qubits, plan.params
+                for start, end, offset in runs:
+                    ops[offset:offset + end - start] = plan_ops[start:end]
+                    qubits[offset:offset + end - start] = plan_qubits[start:end]
+                    params[offset:offset + end - start] = plan_params[start:end]
+                phases = [future.result() for future in futures]
+        else:
+            for start, end, offset in runs:
+                ops[offset:offset + end - start] = plan.ops[start:end]
+                qubits[offset:offset + end - start] = plan.qubits[start:end]
+                params[offset:offset + end - start] = plan.params[start:end]
+            phases = [build_segment(*task) for task in tasks]
+    finally:
+        _output = None
+
+    return GateStream.from_arrays(ops, qubits, params, num_qubits=n, global_phase=plan.global_phase + sum(phases),
+                                  basis=plan.basis, copy=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the n-qubit Toffoli with its segments generated in '
+                                                 'parallel worker processes.')
+    parser.add_argument('n', type=int)
+    parser.add_argument('--variant', choices=VARIANTS, default='combined')
+    parser.add_argument('--basis', choices=list(BASES), default='ibm')
+    parser.add_argument('--error-budget', type=float, default=0.0)
+    parser.add_argument('--depth-vs-cx', choices=n_toffoli_decomp_utils.DEPTH_VS_CX_POLICIES, default='cx')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: all CPUs)')
+    parser.add_argument('--compare', action='store_true', help='also build serially and check the gates agree')
+    args = parser.parse_args()
+    options = dict(variant=args.variant, basis=args.basis, error_budget=args.error_budget,
+                   depth_vs_cx=args.depth_vs_cx)
+
+    start = time.perf_counter()
+    plan = plan_segments(args.n, **options)
+    print('%d segments of %d gates and %d gates between them, planned in %.4fs' % (
+        len(plan.segments), sum(segment[3] for segment in plan.segments), len(plan), time.perf_counter() - start))
+
+    start = time.perf_counter()
+    gates = parallel_build(args.n, jobs=args.jobs, **options)
+    print('parallel: %d gates, %d cx in %.4fs' % (len(gates), gates.count_ops().get('cx', 0),
+                                                 time.perf_counter() - start))
+
+    if args.compare:
+        clear_template_cache()
+        start = time.perf_counter()
+        serial = build_toffoli(args.n, **options)
+        print('serial: %d gates, %d cx in %.4fs' % (len(serial), serial.count_ops().get('cx', 0),
+                                                   time.perf_counter() - start))
+        same = (np.array_equal(gates.ops, serial.ops) and np.array_equal(gates.qubits, serial.qubits)
+                and np.array_equal(gates.params, serial.params)
+                and abs(math.remainder(gates.global_phase - serial.global_phase, 2 * math.pi)) < 1e-9)
+        print('identical' if same else 'DIFFERENT')
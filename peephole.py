@@ -0,0 +1,158 @@
+import argparse
+import math
+import time
+
+from gate_stream import GateStream, BASES, OP_X, OP_H, OP_CX, OP_CCX, OP_RY, OP_U1, OP_ARITY, OP_NAMES
+
+
+# This function re-emits a stream of unlowered gates into a new stream, lowered into basis.
+def lower(gates, basis):
+    lowered = GateStream(gates.num_qubits, basis=basis)
+    lowered.global_phase = gates.global_phase
+    emitters = {OP_X: lowered.x, OP_H: lowered.h, OP_CX: lowered.cx, OP_CCX: lowered.ccx}
+    for op, qubits, params in zip(gates.ops.tolist(), gates.qubits.tolist(), gates.params.tolist()):
+        if op == OP_RY:
+            lowered.ry(params[0], qubits[0])
+        elif op == OP_U1:
+            lowered.u1(params[0], qubits[0])
+        elif op in emitters:
+            emitters[op](*qubits[:OP_ARITY[op]])
+        else:
+            raise ValueError('%s is already a basis gate' % OP_NAMES[op])
+    return lowered
+
+
+def _is_zero_angle(theta, period):
+    return abs(math.remainder(theta, period)) < 1e-12
+
+
+# This function tells whether gate commutes with a gate on qubit of kind 'x' (X on a target),
+# 'z' (a diagonal gate) or 'control' (the control of a CX or CCX).
+def _commutes_on(gate, qubit, kind):
+    op, qubits = gate[0], gate[1]
+    if op in (OP_CX, OP_CCX):
+        is_target = qubits[-1] == qubit
+        return is_target if kind == 'x' else not is_target
+    if op == OP_U1:
+        return kind != 'x'
+    return False
+
+
+# This function removes redundancy from the gates emitted by the decomposition functions in one pass:
+# it cancels adjacent inverse pairs of X, H, CX and CCX, merges adjacent U1 and RY rotations and drops
+# the trivial ones. X gates are looked up past CX and CCX targets, U1 gates and CX/CCX pairs past
+# diagonals and CX/CCX controls, at most window gates back on each qubit, so the pass stays linear.
+# Streams already lowered into a basis keep it, and their other gates (U2, U3, RZ, SX, ...) are kept as they are.
+def optimize(gates, window=16):
+    num_qubits = gates.num_qubits
+    if num_qubits is None:
+        num_qubits = int(gates.qubits.max()) + 1 if len(gates) else 0
+
+    out = []
+    stacks = [[] for _ in range(num_qubits)]
+
+    def remove(idx):
+        out[idx][3] = False
+        for qubit in out[idx][1]:
+            stacks[qubit].remove(idx)
+
+    # This function returns the index of the latest gate on qubit that passes match, looking past gates
+    # that commute on qubit with kind, or None.
+    def find(qubit, kind, match):
+        stack = stacks[qubit]
+        for idx in reversed(stack[max(len(stack) - window, 0):]):
+            if match(out[idx]):
+                return idx
+            if kind is None or not _commutes_on(out[idx], qubit, kind):
+                return None
+        return None
+
+    for op, qubits, params in zip(gates.ops.tolist(), gates.qubits.tolist(), gates.params.tolist()):
+        qubits = tuple(qubits[:OP_ARITY[op]])
+        theta = params[0]
+
+        if op in (OP_X, OP_H):
+            kind = 'x' if op == OP_X else None
+            idx = find(qubits[0], kind, lambda gate: gate[0] == op)
+            if idx is not None:
+                remove(idx)
+                continue
+
+        elif op in (OP_CX, OP_CCX):
+            target, controls = qubits[-1], set(qubits[:-1])
+            idx = find(target, None, lambda gate: gate[0] == op and gate[1][-1] == target
+                       and set(gate[1][:-1]) == controls)
+            if idx is not None and all(find(control, 'control', lambda gate: gate is out[idx]) == idx
+                                       for control in controls):
+                remove(idx)
+                continue
+
+        elif op == OP_U1:
+            idx = find(qubits[0], 'z', lambda gate: gate[0] == OP_U1)
+            if idx is not None:
+                out[idx][2][0] += theta
+                if _is_zero_angle(out[idx][2][0], 2 * math.pi):
+                    remove(idx)
+                continue
+            if _is_zero_angle(theta, 2 * math.pi):
+                continue
+
+        elif op == OP_RY:
+            idx = find(qubits[0], None, lambda gate: gate[0] == OP_RY)
+            if idx is not None:
+                out[idx][2][0] += theta
+                if _is_zero_angle(out[idx][2][0], 4 * math.pi):
+                    remove(idx)
+                continue
+            if _is_zero_angle(theta, 4 * math.pi):
+                continue
+
+        for qubit in qubits:
+            stacks[qubit].append(len(out))
+        out.append([op, qubits, params, True])
+
+    optimized = GateStream(gates.num_qubits, basis=gates.basis)
+    optimized.global_phase = gates.global_phase
+    for op, qubits, params, alive in out:
+        if alive:
+            optimized.append(op, *qubits, params=tuple(params))
+    return optimized
+
+
+# This function optimizes gates and reports the CX count, total gate count, depth and the time it took,
+# before and after, optionally after lowering both into basis.
+def optimize_with_report(gates, basis=None, window=16):
+    start = time.perf_counter()
+    optimized = optimize(gates, window=window)
+    optimize_time = time.perf_counter() - start
+
+    before, after = gates, optimized
+    if basis is not None:
+        before, after = lower(gates, basis), lower(optimized, basis)
+
+    report = {'optimize_time': optimize_time}
+    for name, stream in (('before', before), ('after', after)):
+        report[name] = {'cx': stream.count_ops().get('cx', 0), 'total': len(stream), 'depth': stream.depth()}
+    return optimized, report
+
+
+if __name__ == '__main__':
+    from n_toffoli_decomp_utils import DEPTH_VS_CX_POLICIES
+    from sweep import build_toffoli
+
+    parser = argparse.ArgumentParser(description='Peephole-optimize the n-qubit Toffoli built by Qulin.')
+    parser.add_argument('n_min', type=int)
+    parser.add_argument('n_max', type=int, nargs='?')
+    parser.add_argument('--basis', choices=list(BASES), default='ibm')
+    parser.add_argument('--window', type=int, default=16)
+    parser.add_argument('--error-budget', type=float, default=0.0)
+    parser.add_argument('--depth-vs-cx', choices=DEPTH_VS_CX_POLICIES, default='cx')
+    args = parser.parse_args()
+
+    for n in range(args.n_min, (args.n_min if args.n_max is None else args.n_max) + 1):
+        gates = build_toffoli(n, error_budget=args.error_budget, depth_vs_cx=args.depth_vs_cx)
+
+        _, report = optimize_with_report(gates, basis=BASES[args.basis], window=args.window)
+        before, after = report['before'], report['after']
+        print(n, before['cx'], after['cx'], before['total'], after['total'], before['depth'], after['depth'],
+              '%.4fs' % report['optimize_time'])
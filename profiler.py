@@ -0,0 +1,212 @@
+import argparse
+import functools
+import inspect
+import json
+import time
+
+import numpy as np
+
+import n_toffoli_decomp_utils
+from gate_stream import GateStream, BASES, IBM_BASIS, OP_NAMES
+from sweep import build_toffoli
+from template_cache import bypass_template_cache
+
+
+# This class is a node of the call tree: the calls of one decomposition function from the same parent,
+# with the time spent, the gates emitted (by type, after lowering) and the depth added to the circuit,
+# all including the children.
+class ProfileNode:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.time = 0.0
+        self.gates = np.zeros(len(OP_NAMES), dtype=np.int64)
+        self.depth = 0
+        self.children = {}
+
+    def child(self, name):
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = ProfileNode(name)
+        return node
+
+    @property
+    def self_time(self):
+        return self.time - sum(child.time for child in self.children.values())
+
+    @property
+    def self_gates(self):
+        return self.gates - sum((child.gates for child in self.children.values()), np.zeros_like(self.gates))
+
+    def gate_counts(self, own=False):
+        gates = self.self_gates if own else self.gates
+        return {name: int(cnt) for name, cnt in zip(OP_NAMES, gates) if cnt}
+
+    def to_dict(self):
+        return {'name': self.name, 'calls': self.calls, 'time': self.time, 'self_time': self.self_time,
+                'gates': self.gate_counts(), 'self_gates': self.gate_counts(own=True), 'depth': self.depth,
+                'children': [child.to_dict() for child in self.children.values()]}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    # This function renders the tree as an indented text table.
+    def to_table(self, max_depth=None):
+        lines = ['%-60s %8s %10s %10s %10s %10s %10s' % ('function', 'calls', 'time', 'self time', 'cx', 'total',
+                                                          'depth')]
+
+        def walk(node, level):
+            lines.append('%-60s %8d %9.4fs %9.4fs %10d %10d %10d' % (
+                '  ' * level + node.name, node.calls, node.time, node.self_time,
+                node.gates[OP_NAMES.index('cx')], node.gates.sum(), node.depth))
+            if max_depth is None or level < max_depth:
+                for child in sorted(node.children.values(), key=lambda child: -child.gates.sum()):
+                    walk(child, level + 1)
+
+        walk(self, 0)
+        return '\n'.join(lines)
+
+    # This function renders the tree as collapsed stacks (one 'root;child;grandchild value' line per node),
+    # the input format of flamegraph.pl and speedscope. metric is 'gates', a gate name such as 'cx', or 'time'
+    # (in microseconds), and every line carries the node's own share.
+    def to_collapsed(self, metric='gates'):
+        lines = []
+
+        def walk(node, stack):
+            stack = stack + [node.name]
+            if metric == 'time':
+                value = int(round(node.self_time * 1e6))
+            elif metric == 'gates':
+                value = int(node.self_gates.sum())
+            else:
+                value = int(node.self_gates[OP_NAMES.index(metric)])
+            if value > 0:
+                lines.append('%s %d' % (';'.join(stack), value))
+            for child in node.children.values():
+                walk(child, stack)
+
+        walk(self, [])
+        return '\n'.join(lines)
+
+
+# This function returns the decomposition functions of n_toffoli_decomp_utils.py, those taking qc first.
+def decomposition_functions():
+    functions = {}
+    for name, function in vars(n_toffoli_decomp_utils).items():
+        if inspect.isfunction(function) and function.__module__ == n_toffoli_decomp_utils.__name__:
+            parameters = list(inspect.signature(function).parameters)
+            if parameters and parameters[0] == 'qc':
+                functions[name] = function
+    return functions
+
+
+# This class records the call tree of the decomposition functions emitting into a GateStream.
+# Only while the profiler is active are the functions of n_toffoli_decomp_utils.py replaced by wrappers
+# (and the template cache bypassed, so that every call really runs, without touching its contents); outside
+# of it nothing is wrapped and the build runs at full speed.
+class Profiler:
+    def __init__(self, gates, root_name='build'):
+        self.gates = gates
+        self.root = ProfileNode(root_name)
+        self._stack = [self.root]
+        self._originals = {}
+        self._processed = 0
+        num_qubits = gates.num_qubits if gates.num_qubits is not None else 0
+        self._times = [0] * num_qubits
+        self._depth = 0
+
+    # This function advances the per-qubit depth over the gates emitted since the last call.
+    def _advance(self):
+        end = len(self.gates)
+        if end == self._processed:
+            return self._depth
+        times = self._times
+        for q0, q1, q2 in self.gates.qubits[self._processed:end].tolist():
+            if max(q0, q1, q2) >= len(times):
+                times.extend([0] * (max(q0, q1, q2) + 1 - len(times)))
+            if q1 < 0:
+                times[q0] += 1
+                time_after = times[q0]
+            elif q2 < 0:
+                time_after = times[q0] = times[q1] = max(times[q0], times[q1]) + 1
+            else:
+                time_after = times[q0] = times[q1] = times[q2] = max(times[q0], times[q1], times[q2]) + 1
+            if time_after > self._depth:
+                self._depth = time_after
+        self._processed = end
+        return self._depth
+
+    def _wrap(self, name, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            node = self._stack[-1].child(name)
+            self._stack.append(node)
+            start = len(self.gates)
+            depth = self._advance()
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                node.time += time.perf_counter() - start_time
+                node.calls += 1
+                node.depth += self._advance() - depth
+                end = len(self.gates)
+                if end > start:
+                    node.gates += np.bincount(self.gates.ops[start:end], minlength=len(OP_NAMES))
+                self._stack.pop()
+
+        return wrapper
+
+    def __enter__(self):
+        self._bypass = bypass_template_cache()
+        self._bypass.__enter__()
+        for name, function in decomposition_functions().items():
+            self._originals[name] = function
+            setattr(n_toffoli_decomp_utils, name, self._wrap(name, function))
+        self._start_gates = len(self.gates)
+        self._start_depth = self._advance()
+        self._start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.root.time += time.perf_counter() - self._start_time
+        self.root.calls += 1
+        self.root.depth += self._advance() - self._start_depth
+        end = len(self.gates)
+        if end > self._start_gates:
+            self.root.gates += np.bincount(self.gates.ops[self._start_gates:end], minlength=len(OP_NAMES))
+        for name, function in self._originals.items():
+            setattr(n_toffoli_decomp_utils, name, function)
+        self._originals = {}
+        self._bypass.__exit__(None, None, None)
+        return False
+
+
+# This function builds the n-qubit Toffoli of main.py (or the CCZ with toffoli=False) under the profiler
+# and returns the root of its call tree.
+def profile_build(n, basis=IBM_BASIS, toffoli=True, error_budget=0.0, depth_vs_cx='cx'):
+    gates = GateStream(n, basis=basis)
+    with Profiler(gates) as profiler:
+        build_toffoli(n, error_budget=error_budget, depth_vs_cx=depth_vs_cx, gates=gates, toffoli=toffoli)
+    return profiler.root
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Profile the subroutines of the n-qubit Toffoli built by Qulin.')
+    parser.add_argument('n', type=int)
+    parser.add_argument('--basis', choices=list(BASES), default='ibm')
+    parser.add_argument('--format', choices=('table', 'json', 'collapsed'), default='table')
+    parser.add_argument('--metric', default='gates', help="collapsed stacks value: gates, time or a gate name")
+    parser.add_argument('--max-depth', type=int, default=None, help='deepest level shown in the table')
+    parser.add_argument('--error-budget', type=float, default=0.0)
+    parser.add_argument('--depth-vs-cx', choices=n_toffoli_decomp_utils.DEPTH_VS_CX_POLICIES, default='cx')
+    args = parser.parse_args()
+
+    root = profile_build(args.n, basis=BASES[args.basis], error_budget=args.error_budget,
+                         depth_vs_cx=args.depth_vs_cx)
+    if args.format == 'table':
+        print(root.to_table(max_depth=args.max_depth))
+    elif args.format == 'json':
+        print(root.to_json(indent=1))
+    else:
+        print(root.to_collapsed(metric=args.metric))
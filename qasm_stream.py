@@ -0,0 +1,161 @@
+import argparse
+import queue
+import sys
+import threading
+import time
+
+from gate_stream import GateSink, BASES, IBM_BASIS, OP_NAMES, OP_ARITY, OP_RY, OP_U1, OP_U2, OP_U3, OP_RZ
+from n_toffoli_decomp_utils import DEPTH_VS_CX_POLICIES
+from sweep import build_toffoli
+
+
+_PARAM_COUNTS = {OP_RY: 1, OP_U1: 1, OP_U2: 2, OP_U3: 3, OP_RZ: 1}
+
+_HEADERS = {
+    2: 'OPENQASM 2.0;\ninclude "qelib1.inc";\nqreg q[%d];\n',
+    3: 'OPENQASM 3.0;\ninclude "stdgates.inc";\nqubit[%d] q;\n',
+}
+
+
+def _statement_template(op):
+    param_count = _PARAM_COUNTS.get(op, 0)
+    params = '(%s)' % ','.join(['%r'] * param_count) if param_count else ''
+    return '%s%s %s;\n' % (OP_NAMES[op], params, ','.join(['q[%d]'] * OP_ARITY[op]))
+
+
+_TEMPLATES = [_statement_template(op) for op in range(len(OP_NAMES))]
+
+
+# This class writes every emitted gate as an OpenQASM 2 or 3 statement to a text file as the gates arrive,
+# buffer_size statements at a time, so nothing but the buffer is kept in memory.
+# The header goes out as soon as the writer is created. OpenQASM 3 gets the global phase of the lowering
+# as a final gphase statement; OpenQASM 2 cannot express it and drops it, as qiskit.qasm2.dumps does.
+class QasmWriter(GateSink):
+    def __init__(self, file, num_qubits, version=2, basis=None, buffer_size=4096):
+        super().__init__(basis)
+        if version not in _HEADERS:
+            raise ValueError('OpenQASM version must be 2 or 3, not %r' % version)
+        self.file = file
+        self.version = version
+        self.buffer_size = buffer_size
+        self.gate_count = 0
+        self._lines = []
+        self.file.write(_HEADERS[version] % num_qubits)
+        self.file.flush()
+
+    def emit(self, op, qubits, params=(0.0, 0.0, 0.0)):
+        self._lines.append(_TEMPLATES[op] % (tuple(params[:_PARAM_COUNTS.get(op, 0)]) + tuple(qubits)))
+        if len(self._lines) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.gate_count += len(self._lines)
+        self.file.write(''.join(self._lines))
+        self.file.flush()
+        self._lines = []
+
+    def close(self):
+        self.flush()
+        if self.version == 3 and self.global_phase:
+            self.file.write('gphase(%r);\n' % self.global_phase)
+            self.file.flush()
+
+
+# This function writes the n-qubit Toffoli (or CCZ) built by ccz_qulin_combined as OpenQASM to file,
+# a path or an open text file, while it is built. It returns the number of gates written.
+def write_qasm(file, n, version=2, basis=IBM_BASIS, toffoli=True, error_budget=0.0, depth_vs_cx='cx',
+               buffer_size=4096):
+    if isinstance(file, str):
+        with open(file, 'w') as opened_file:
+            return write_qasm(opened_file, n, version=version, basis=basis, toffoli=toffoli,
+                              error_budget=error_budget, depth_vs_cx=depth_vs_cx, buffer_size=buffer_size)
+
+    writer = QasmWriter(file, n, version=version, basis=basis, buffer_size=buffer_size)
+    build_toffoli(n, error_budget=error_budget, depth_vs_cx=depth_vs_cx, gates=writer, toffoli=toffoli)
+    writer.close()
+    return writer.gate_count
+
+
+class _Stopped(Exception):
+    pass
+
+
+# This class hands the emitted gates over to the consuming thread in batches, through a bounded queue.
+class _QueueSink(GateSink):
+    def __init__(self, gate_queue, stop, basis=None, batch_size=4096):
+        super().__init__(basis)
+        self.gate_queue = gate_queue
+        self.stop = stop
+        self.batch_size = batch_size
+        self._batch = []
+
+    def emit(self, op, qubits, params=(0.0, 0.0, 0.0)):
+        self._batch.append((op, tuple(qubits), tuple(params)))
+        if len(self._batch) >= self.batch_size:
+            self.put(self._batch)
+            self._batch = []
+
+    def put(self, item):
+        while True:
+            if self.stop.is_set():
+                raise _Stopped()
+            try:
+                self.gate_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+# This generator yields the gates of the n-qubit Toffoli (or CCZ) built by ccz_qulin_combined one at a time,
+# as (opcode, qubits, parameters), while they are built in a background thread. At most max_batches batches
+# of batch_size gates are held at any time. Its return value is the global phase the lowering adds.
+def iter_gates(n, basis=None, toffoli=True, error_budget=0.0, depth_vs_cx='cx', batch_size=4096, max_batches=4):
+    gate_queue = queue.Queue(maxsize=max_batches)
+    stop = threading.Event()
+    sink = _QueueSink(gate_queue, stop, basis=basis, batch_size=batch_size)
+    done = object()
+
+    def produce():
+        try:
+            build_toffoli(n, error_budget=error_budget, depth_vs_cx=depth_vs_cx, gates=sink, toffoli=toffoli)
+            sink.put(sink._batch)
+            sink.put(done)
+        except _Stopped:
+            pass
+        except BaseException as error:
+            try:
+                sink.put(error)
+            except _Stopped:
+                pass
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            batch = gate_queue.get()
+            if batch is done:
+                return sink.global_phase
+            if isinstance(batch, BaseException):
+                raise batch
+            yield from batch
+    finally:
+        stop.set()
+        producer.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stream the n-qubit Toffoli built by Qulin to OpenQASM.')
+    parser.add_argument('n', type=int)
+    parser.add_argument('--output', default='-', help='the .qasm file to write (default: standard output)')
+    parser.add_argument('--version', type=int, choices=(2, 3), default=2)
+    parser.add_argument('--basis', choices=list(BASES), default='ibm')
+    parser.add_argument('--ccz', action='store_true', help='write the CCZ without the H gates on the target')
+    parser.add_argument('--error-budget', type=float, default=0.0)
+    parser.add_argument('--depth-vs-cx', choices=DEPTH_VS_CX_POLICIES, default='cx')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    output = sys.stdout if args.output == '-' else args.output
+    gate_count = write_qasm(output, args.n, version=args.version, basis=BASES[args.basis], toffoli=not args.ccz,
+                            error_budget=args.error_budget, depth_vs_cx=args.depth_vs_cx)
+    print('%d gates in %.2fs' % (gate_count, time.perf_counter() - start), file=sys.stderr)
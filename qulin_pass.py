@@ -0,0 +1,178 @@
+import argparse
+import math
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+from gate_stream import GateStream, BASES, IBM_BASIS
+from n_toffoli_decomp_utils import DEPTH_VS_CX_POLICIES
+from sweep import build_toffoli
+
+
+# ccz_qulin_combined needs at least 5 qubits.
+MIN_WIDTH = 5
+
+
+# This function builds the n-qubit CCZ (or, with toffoli=True, the Toffoli of main.py) on qubits 0..n-1,
+# with X gates around the open_controls, and returns its gate arrays so that worker processes can send it back.
+def build_arrays(n, toffoli, open_controls, basis, error_budget=0.0, depth_vs_cx='cx'):
+    gates = GateStream(n, basis=basis)
+    for qubit in open_controls:
+        gates.x(qubit)
+    build_toffoli(n, error_budget=error_budget, depth_vs_cx=depth_vs_cx, gates=gates, toffoli=toffoli)
+    for qubit in open_controls:
+        gates.x(qubit)
+    return gates.ops.copy(), gates.qubits.copy(), gates.params.copy(), gates.global_phase
+
+
+# This function tells whether a gate is a multi-controlled X (True), a multi-controlled Z (False),
+# including MCPhase(pi), or neither (None). Only gates with a single target and nothing but controls besides
+# it count: multi-target gates such as MCMTGate and gates with ancillas such as MCXVChain are neither.
+def qulin_kind(operation):
+    base_gate = getattr(operation, 'base_gate', None)
+    num_ctrl_qubits = getattr(operation, 'num_ctrl_qubits', 0)
+    if base_gate is None or num_ctrl_qubits < 1 or base_gate.num_qubits != 1 \
+            or operation.num_qubits != num_ctrl_qubits + 1:
+        return None
+    if base_gate.name == 'x':
+        return True
+    if base_gate.name == 'z':
+        return False
+    if base_gate.name in ('p', 'u1'):
+        try:
+            angle = float(base_gate.params[0])
+        except TypeError:
+            return None
+        if abs(math.remainder(angle - math.pi, 2 * math.pi)) < 1e-12:
+            return False
+    return None
+
+
+def _make_pass_class():
+    from qiskit.converters import circuit_to_dag
+    from qiskit.transpiler.basepasses import TransformationPass
+
+    # This pass rewrites every multi-controlled X, Z and Phase(pi) on at least min_width qubits with
+    # ccz_qulin_combined, in H sandwiches for X as main.py does, and in X sandwiches for open controls.
+    # The decomposition of each width is built once and reused for every gate of that width (also across
+    # runs of the same pass), and the widths a circuit still needs are built in parallel over jobs processes.
+    class QulinSynthesis(TransformationPass):
+        def __init__(self, basis=IBM_BASIS, min_width=MIN_WIDTH, jobs=None, error_budget=0.0, depth_vs_cx='cx'):
+            super().__init__()
+            self.basis = None if basis is None else tuple(basis)
+            self.min_width = max(min_width, MIN_WIDTH)
+            self.jobs = jobs
+            self.error_budget = error_budget
+            self.depth_vs_cx = depth_vs_cx
+            self._dags = {}
+
+        def _ensure_dags(self, keys):
+            keys = sorted(set(keys) - set(self._dags), reverse=True)
+            if not keys:
+                return
+            options = (self.basis, self.error_budget, self.depth_vs_cx)
+            if len(keys) == 1 or self.jobs == 1:
+                arrays = [build_arrays(*key, *options) for key in keys]
+            else:
+                with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                    arrays = list(executor.map(build_arrays, *zip(*[key + options for key in keys])))
+            for key, key_arrays in zip(keys, arrays):
+                gates = GateStream.from_arrays(*key_arrays[:3], num_qubits=key[0], global_phase=key_arrays[3])
+                self._dags[key] = circuit_to_dag(gates.to_circuit())
+
+        def run(self, dag):
+            nodes = []
+            for node in dag.op_nodes():
+                toffoli = qulin_kind(node.op)
+                if toffoli is None or len(node.qargs) < self.min_width or node.cargs:
+                    continue
+                open_controls = tuple(idx for idx in range(node.op.num_ctrl_qubits)
+                                      if not node.op.ctrl_state >> idx & 1)
+                nodes.append((node, (len(node.qargs), toffoli, open_controls)))
+
+            self._ensure_dags(key for _, key in nodes)
+            for node, key in nodes:
+                replacement = self._dags[key]
+                dag.substitute_node_with_dag(node, replacement, wires=replacement.qubits)
+            return dag
+
+    return QulinSynthesis
+
+
+_pass_class = None
+
+
+# This function returns the QulinSynthesis TransformationPass. Qiskit is only imported when it is called.
+def qulin_synthesis_pass(basis=IBM_BASIS, min_width=MIN_WIDTH, jobs=None, error_budget=0.0, depth_vs_cx='cx'):
+    global _pass_class
+    if _pass_class is None:
+        _pass_class = _make_pass_class()
+    return _pass_class(basis=basis, min_width=min_width, jobs=jobs, error_budget=error_budget,
+                       depth_vs_cx=depth_vs_cx)
+
+
+# This function returns a copy of the circuit qc with every multi-controlled X, Z and Phase(pi) on at least
+# min_width qubits compiled by Qulin. Only those gates are replaced (emitted into basis); the rest of the
+# circuit is left as it is for the transpiler.
+def compile_circuit(qc, basis=IBM_BASIS, min_width=MIN_WIDTH, jobs=None, error_budget=0.0, depth_vs_cx='cx'):
+    from qiskit.transpiler import PassManager
+
+    return PassManager([qulin_synthesis_pass(basis=basis, min_width=min_width, jobs=jobs, error_budget=error_budget,
+                                             depth_vs_cx=depth_vs_cx)]).run(qc)
+
+
+# This function compiles a 7-qubit circuit mixing gates the pass rewrites (MCX, MCZ and MCPhase(pi), with
+# an open control) and gates it must leave alone (MCMTGate with two targets, MCXVChain with a dirty ancilla,
+# MCPhase(pi / 2)) and returns whether the compiled circuit has the same operator.
+def check_compile(basis=IBM_BASIS):
+    from qiskit import QuantumCircuit
+    from qiskit.circuit.library import MCMTGate, MCPhaseGate, MCXGate, MCXVChain, XGate, ZGate
+    from qiskit.quantum_info import Operator
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        chain = MCXVChain(4, dirty_ancillas=True)
+    qc = QuantumCircuit(7)
+    qc.h(range(7))
+    qc.append(MCXGate(6, ctrl_state='101101'), range(7))
+    qc.append(MCMTGate(XGate(), 5, 2), range(7))
+    qc.append(ZGate().control(5), [6, 0, 1, 2, 3, 4])
+    qc.append(chain, range(7))
+    qc.append(MCPhaseGate(math.pi, 4), range(5))
+    qc.append(MCPhaseGate(math.pi / 2, 5), range(6))
+    return Operator(qc).equiv(Operator(compile_circuit(qc, basis=basis)))
+
+
+if __name__ == '__main__':
+    from qiskit import QuantumCircuit
+    from qiskit.circuit.library import MCXGate
+
+    parser = argparse.ArgumentParser(description='Compile a random oracle of multi-controlled X gates with Qulin.')
+    parser.add_argument('num_qubits', type=int)
+    parser.add_argument('--gates', type=int, default=100)
+    parser.add_argument('--basis', choices=list(BASES), default='ibm')
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--error-budget', type=float, default=0.0)
+    parser.add_argument('--depth-vs-cx', choices=DEPTH_VS_CX_POLICIES, default='cx')
+    parser.add_argument('--check', action='store_true',
+                        help='first check that the pass keeps the operator of a 7-qubit circuit of mixed gates')
+    args = parser.parse_args()
+
+    if args.check:
+        print('check', 'ok' if check_compile(basis=BASES[args.basis]) else 'FAILED')
+
+    import random
+
+    rng = random.Random(args.seed)
+    oracle = QuantumCircuit(args.num_qubits)
+    for _ in range(args.gates):
+        width = rng.randint(MIN_WIDTH, args.num_qubits)
+        qubits = rng.sample(range(args.num_qubits), width)
+        oracle.append(MCXGate(width - 1), qubits)
+
+    start = time.perf_counter()
+    compiled = compile_circuit(oracle, basis=BASES[args.basis], jobs=args.jobs, error_budget=args.error_budget,
+                               depth_vs_cx=args.depth_vs_cx)
+    print('%d gates, %d CX in %.2fs' % (len(compiled.data), compiled.count_ops().get('cx', 0),
+                                       time.perf_counter() - start))
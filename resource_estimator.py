@@ -0,0 +1,407 @@
+import argparse
+from collections import Counter
+from functools import lru_cache
+
+from gate_stream import GateSink, LOWERINGS, OP_ARITY, OP_CODES, OP_NAMES, BASES, IBM_BASIS, \
+    CLIFFORD_T_BASIS
+from n_toffoli_decomp_utils import QULIN_THETA, ccz_qulin_combined, ladder_thetas, ladder_size, \
+    norm_budget_for_infidelity, infidelity_bound, GateStream, DEPTH_VS_CX_POLICIES
+from template_cache import template_key, build_template
+
+
+def _combine(*terms):
+    total = Counter()
+    for weight, counts in terms:
+        for name, cnt in counts.items():
+            total[name] += weight * cnt
+    return total
+
+
+# The following functions count the gates emitted by the functions of the same name in n_toffoli_decomp_utils.py.
+@lru_cache(maxsize=None)
+def _count_ux_gate():
+    return Counter(cx=2, ccx=1)
+
+
+@lru_cache(maxsize=None)
+def _count_c_u1():
+    return Counter(u1=3, cx=2)
+
+
+@lru_cache(maxsize=None)
+def _count_cc_u1():
+    return _combine((1, Counter(cx=4, u1=4)), (1, _count_c_u1()))
+
+
+@lru_cache(maxsize=None)
+def _count_ccc_u1():
+    return _combine((1, Counter(cx=8, u1=8)), (1, _count_cc_u1()))
+
+
+@lru_cache(maxsize=None)
+def _count_c_u1_ladder(m, t):
+    if m == 0:
+        return Counter()
+    shared_cx = sum(2 ** top for top in range(1, t))
+    return Counter(cx=m * 2 ** t + shared_cx, u1=m * 2 ** t + 2 ** t - 1)
+
+
+@lru_cache(maxsize=None)
+def _count_large_plus_1_gate_w_enough_ancilla(m):
+    return _combine((1, Counter(x=2 * m + 3, cx=2 * m + 2)), (4 * (m - 1), _count_ux_gate()))
+
+
+@lru_cache(maxsize=None)
+def _count_margolus_gate():
+    return Counter(ry=4, cx=3)
+
+
+@lru_cache(maxsize=None)
+def _count_prefix_xor_gate(m):
+    cx = 0
+    step = 1
+    while step < m:
+        cx += len(range(2 * step - 1, m, 2 * step))
+        step *= 2
+    step //= 2
+    while step >= 1:
+        cx += len(range(3 * step - 1, m, 2 * step))
+        step //= 2
+    return Counter(cx=cx)
+
+
+@lru_cache(maxsize=None)
+def _count_large_add_gate(m):
+    return _combine((1, Counter(cx=3 * m - 2)), (2, _count_prefix_xor_gate(m - 1)),
+                    (2 * (m - 1), _count_margolus_gate()))
+
+
+@lru_cache(maxsize=None)
+def _count_large_plus_1_gate_low_depth(m):
+    return _combine((1, Counter(x=4 * m)), (2, _count_large_add_gate(m)))
+
+
+def _count_plus_1_gate(m, depth_vs_cx):
+    if depth_vs_cx == 'depth':
+        return _count_large_plus_1_gate_low_depth(m)
+    return _count_large_plus_1_gate_w_enough_ancilla(m)
+
+
+@lru_cache(maxsize=None)
+def _count_large_toffoli_w_enough_ancilla(m):
+    if m <= 3:
+        return Counter(ccx=1) if m == 3 else Counter(cx=1)
+
+    toffoli_n = 2 * m - 3
+    down_cnt = max(len(range(toffoli_n - 3, 1, -2)) - 1, 0)
+    up_cnt = max(len(range(0, toffoli_n - 4, 2)) - 1, 0)
+    return Counter(ccx=2, ry=2 * (2 * down_cnt + 4 + 2 * up_cnt), cx=2 * (2 * down_cnt + 3 + 2 * up_cnt))
+
+
+@lru_cache(maxsize=None)
+def _count_large_rz_8_CX(m):
+    if m == 3:
+        return Counter(cx=4, u1=4)
+
+    control_n = m - 1
+    qubit_3rd = control_n // 3
+    qubit_2nd = (control_n - qubit_3rd) // 2
+    qubit_1st = control_n - qubit_3rd - qubit_2nd
+    return _combine((1, Counter(u1=8)), (4, _count_large_toffoli_8_CX(qubit_3rd + 1)),
+                    (2, _count_large_toffoli_8_CX(qubit_2nd + 1)), (2, _count_large_toffoli_8_CX(qubit_1st + 1)))
+
+
+@lru_cache(maxsize=None)
+def _count_large_toffoli_8_CX(m):
+    if m > 2:
+        return _combine((1, Counter(h=2)), (1, _count_large_rz_8_CX(m)))
+    return Counter(cx=1)
+
+
+@lru_cache(maxsize=None)
+def _count_large_increment_gate(m, flag_add, depth_vs_cx='cx'):
+    first_half_n = m // 2 + 1
+    second_half_n = m - first_half_n
+    return _combine((2, _count_plus_1_gate(second_half_n + 1, depth_vs_cx)),
+                    (1, Counter(x=2 + (0 if flag_add else 2 * m), cx=2 * second_half_n)),
+                    (2, _count_large_toffoli_w_enough_ancilla(first_half_n + 1)),
+                    (1, _count_plus_1_gate(first_half_n, depth_vs_cx)))
+
+
+@lru_cache(maxsize=None)
+def _count_large_increment_gate_smallqulin_w_ancilla(m, depth_vs_cx='cx'):
+    if m >= 11:
+        return _count_plus_1_gate(m, depth_vs_cx)
+
+    terms = [(1, _count_large_toffoli_w_enough_ancilla(idx)) for idx in range(m, 4, -1)]
+    if m >= 4:
+        terms += [(1, Counter(h=2)), (1, _count_ccc_u1())]
+    if m >= 3:
+        terms += [(1, Counter(h=2)), (1, _count_cc_u1())]
+    terms.append((1, Counter(cx=1, x=1)))
+    return _combine(*terms)
+
+
+@lru_cache(maxsize=None)
+def _count_large_increment_gate_smallqulin(m, flag_add, depth_vs_cx='cx'):
+    first_half_n = m // 2 + 1
+    second_half_n = m - first_half_n
+    if first_half_n < 10:
+        large_toffoli = _combine((1, Counter(h=2)), (1, _count_large_rz_8_CX(first_half_n + 1)))
+    else:
+        large_toffoli = _count_large_toffoli_w_enough_ancilla(first_half_n + 1)
+    return _combine((2, _count_large_increment_gate_smallqulin_w_ancilla(second_half_n + 1, depth_vs_cx)),
+                    (1, Counter(x=2 + (0 if flag_add else 2 * m), cx=2 * second_half_n)),
+                    (2, large_toffoli),
+                    (1, _count_large_increment_gate_smallqulin_w_ancilla(first_half_n, depth_vs_cx)))
+
+
+# This function counts the two ladders of m and m + 1 controls, without the blocks error_budget drops.
+def _count_ladders(m, t, error_budget):
+    ladders, _ = ladder_thetas(QULIN_THETA / 2, m, error_budget)
+    return _combine(*((1, _count_c_u1_ladder(sum(1 for idx_theta in thetas if idx_theta != 0), t))
+                      for thetas in ladders))
+
+
+@lru_cache(maxsize=None)
+def _count_ccz_smallqulin(n, error_budget=0.0, depth_vs_cx='cx'):
+    return _combine((1, _count_large_increment_gate_smallqulin(n - 2, True, depth_vs_cx)),
+                    (1, _count_large_increment_gate_smallqulin(n - 2, False, depth_vs_cx)),
+                    (1, _count_ladders(n - 3, 2, error_budget)))
+
+
+@lru_cache(maxsize=None)
+def _count_ccz_qulin(n, error_budget=0.0, depth_vs_cx='cx'):
+    if n % 2 == 0:
+        return _combine((1, _count_large_increment_gate(n - 1, True, depth_vs_cx)),
+                        (1, _count_large_increment_gate(n - 1, False, depth_vs_cx)),
+                        (1, _count_ladders(n - 2, 1, error_budget)))
+    return _combine((1, _count_large_increment_gate(n - 2, True, depth_vs_cx)),
+                    (1, _count_large_increment_gate(n - 2, False, depth_vs_cx)),
+                    (1, _count_ladders(n - 3, 2, error_budget)))
+
+
+def _count_ccz_qulin_combined(n, error_budget=0.0, depth_vs_cx='cx'):
+    if n <= 22:
+        return _count_ccz_smallqulin(n, error_budget, depth_vs_cx)
+    return _count_ccz_qulin(n, error_budget, depth_vs_cx)
+
+
+def _lower_counts(counts, basis):
+    if basis is None:
+        return Counter(counts)
+    lowering = LOWERINGS[tuple(basis)]
+    return _combine(*[(cnt, Counter(OP_NAMES[basis_op] for basis_op, _, _ in lowering[OP_CODES[op]][0]))
+                      for op, cnt in counts.items()])
+
+
+# This function returns the number of gates one call of the decomposition function name emits lowered into
+# basis, from the closed forms above (arguments are those of the call), or None if the function has none or
+# the basis is Clifford+T, whose lowering depends on the angles.
+def count_call(name, arguments, basis):
+    counter = globals().get('_count_' + name)
+    if counter is None or (basis is not None and tuple(basis) == CLIFFORD_T_BASIS):
+        return None
+    options = (arguments['depth_vs_cx'],) if 'depth_vs_cx' in arguments else ()
+    return sum(_lower_counts(counter(len(arguments['operated_qubits']), *options), basis).values())
+
+
+# This function computes, for every gate emitted by the decomposition functions, how far its lowered
+# gate sequence pushes each of its qubits: delay[j][i] is the longest path from input i to output j.
+def _depth_delays(basis):
+    delays = {}
+    for op in ('x', 'h', 'cx', 'ccx', 'ry', 'u1'):
+        arity = OP_ARITY[OP_CODES[op]]
+        if basis is None:
+            sequence = [tuple(range(arity))]
+        else:
+            sequence = [local_qubits for _, local_qubits, _ in LOWERINGS[tuple(basis)][OP_CODES[op]][0]]
+        delay = []
+        for output_qubit in range(arity):
+            row = []
+            for input_qubit in range(arity):
+                times = [None] * arity
+                times[input_qubit] = 0
+                for qubits in sequence:
+                    reached = [times[q] for q in qubits if times[q] is not None]
+                    if reached:
+                        for q in qubits:
+                            times[q] = max(reached) + 1
+                row.append(times[output_qubit])
+            delay.append(row)
+        delays[op] = delay
+    return delays
+
+
+# A delay that stands for no path, low enough to never win a max.
+_NO_PATH = - 1 << 40
+
+
+# This class is a gate sink that only tracks the circuit depth after lowering, without storing any gate.
+# A cached decomposition function is taken as a whole through its delay profile: its unlowered gates on
+# local qubits, keyed like its template and compiled once into steps of (qubits, delays). Depth is invariant
+# under shifting all input times, so the output times of a profile are also memoized on the input times
+# relative to the earliest one, and repeated calls in the same situation cost one lookup.
+class DepthSink(GateSink):
+    def __init__(self, num_qubits, basis=IBM_BASIS):
+        super().__init__()
+        self.times = [0] * num_qubits
+        self._delays = _depth_delays(basis)
+        self._flat_delays = [tuple(_NO_PATH if d is None else d for row in self._delays[OP_NAMES[op]] for d in row)
+                             if OP_NAMES[op] in self._delays else None for op in range(len(OP_NAMES))]
+        self._profiles = {}
+        self._outputs = {}
+
+    def _apply(self, op, qubits):
+        times = self.times
+        start = [times[q] for q in qubits]
+        for qubit, row in zip(qubits, self._delays[op]):
+            times[qubit] = max(s + d for s, d in zip(start, row) if d is not None)
+
+    def x(self, qubit):
+        self._apply('x', (qubit,))
+
+    def h(self, qubit):
+        self._apply('h', (qubit,))
+
+    def cx(self, control_qubit, target_qubit):
+        self._apply('cx', (control_qubit, target_qubit))
+
+    def ccx(self, control_qubit_1, control_qubit_2, target_qubit):
+        self._apply('ccx', (control_qubit_1, control_qubit_2, target_qubit))
+
+    def ry(self, theta, qubit):
+        self._apply('ry', (qubit,))
+
+    def u1(self, theta, qubit):
+        self._apply('u1', (qubit,))
+
+    # This function returns the compiled delay profile of a call of a cached decomposition function.
+    def _profile(self, key, function, arguments):
+        steps = self._profiles.get(key)
+        if steps is None:
+            _, template = build_template(function, None, arguments)
+            flat_delays = self._flat_delays
+            steps = self._profiles[key] = [(q0, q1, q2, flat_delays[op]) for op, (q0, q1, q2) in
+                                           zip(template.ops.tolist(), template.qubits.tolist())]
+        return steps
+
+    # This function advances the times over a call of a cached decomposition function (see cached_template).
+    def apply_template(self, function, arguments):
+        key, qubit_lists = template_key(function, None, arguments)
+        qubits = [qubit for _, value in qubit_lists for qubit in value]
+        times = self.times
+        start = [times[q] for q in qubits]
+        base = min(start, default=0)
+        relative = tuple(s - base for s in start)
+        output = self._outputs.get((key, relative))
+        if output is None:
+            output = list(relative)
+            for q0, q1, q2, d in self._profile(key, function, arguments):
+                if q1 < 0:
+                    output[q0] += d[0]
+                elif q2 < 0:
+                    t0, t1 = output[q0], output[q1]
+                    output[q0] = max(t0 + d[0], t1 + d[1])
+                    output[q1] = max(t0 + d[2], t1 + d[3])
+                else:
+                    t0, t1, t2 = output[q0], output[q1], output[q2]
+                    output[q0] = max(t0 + d[0], t1 + d[1], t2 + d[2])
+                    output[q1] = max(t0 + d[3], t1 + d[4], t2 + d[5])
+                    output[q2] = max(t0 + d[6], t1 + d[7], t2 + d[8])
+            self._outputs[(key, relative)] = output
+        for qubit, time in zip(qubits, output):
+            times[qubit] = time + base
+
+    def depth(self):
+        return max(self.times, default=0)
+
+
+# This function estimates the gate counts and depth of the n-qubit Toffoli (toffoli=True, as in main.py)
+# or CCZ (toffoli=False) built by ccz_qulin_combined, after unrolling into basis (None keeps the emitted gates).
+# With error_budget > 0 it also returns the proven operator-norm error of the approximate circuit.
+# The Clifford+T basis lowers the rotations by their angles and is costed by ft_cost.py instead.
+def estimate_resources(n, basis=IBM_BASIS, toffoli=True, depth=True, error_budget=0.0, depth_vs_cx='cx'):
+    if basis is not None and tuple(basis) == CLIFFORD_T_BASIS:
+        raise ValueError('the Clifford+T gate counts depend on the angles, use ft_cost.estimate_clifford_t')
+    counts = _count_ccz_qulin_combined(n, error_budget, depth_vs_cx)
+    if toffoli:
+        counts = _combine((1, counts), (1, Counter(h=2)))
+    counts = _lower_counts(counts, basis)
+
+    resources = {'cx': counts['cx'], 'total': sum(counts.values()), 'counts': dict(counts)}
+
+    if depth:
+        sink = DepthSink(n, basis=basis)
+        if toffoli:
+            sink.h(n - 1)
+        ccz_qulin_combined(sink, list(range(n)), error_budget=error_budget, depth_vs_cx=depth_vs_cx)
+        if toffoli:
+            sink.h(n - 1)
+        resources['depth'] = sink.depth()
+
+    if error_budget > 0:
+        resources['error_bound'] = ladder_thetas(QULIN_THETA / 2, ladder_size(n), error_budget)[1]
+
+    return resources
+
+
+# This function builds and transpiles the real circuit and returns its resources next to the estimated ones.
+def check_resource_estimate(n, basis=IBM_BASIS, toffoli=True, error_budget=0.0, depth_vs_cx='cx'):
+    from qiskit import transpile
+
+    gates = GateStream(n)
+    if toffoli:
+        gates.h(n - 1)
+    ccz_qulin_combined(gates, list(range(n)), error_budget=error_budget, depth_vs_cx=depth_vs_cx)
+    if toffoli:
+        gates.h(n - 1)
+
+    qc = gates.to_circuit()
+    if basis is not None:
+        qc = transpile(qc, basis_gates=list(basis), optimization_level=0)
+
+    counts = Counter(gate.operation.name for gate in qc.data)
+    measured = {'cx': counts['cx'], 'total': sum(counts.values()), 'counts': dict(counts), 'depth': qc.depth()}
+    return estimate_resources(n, basis=basis, toffoli=toffoli, error_budget=error_budget,
+                              depth_vs_cx=depth_vs_cx), measured
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Estimate the resources of the n-qubit Toffoli built by Qulin.')
+    parser.add_argument('n_min', type=int)
+    parser.add_argument('n_max', type=int, nargs='?')
+    parser.add_argument('--basis', choices=[name for name in BASES if name != 'clifford_t'], default='ibm')
+    parser.add_argument('--no-depth', action='store_true', help='only compute the gate counts')
+    parser.add_argument('--check', action='store_true', help='cross-check against the built and transpiled circuit')
+    parser.add_argument('--error-budget', type=float, default=0.0,
+                        help='drop negligible controlled phases within this operator-norm error')
+    parser.add_argument('--infidelity-budget', type=float, default=None,
+                        help='the same, as an average gate infidelity')
+    parser.add_argument('--depth-vs-cx', choices=DEPTH_VS_CX_POLICIES, default='cx',
+                        help="the U_{+1} construction: Fig.18 ('cx') or the adders ('depth', also fewer CX)")
+    args = parser.parse_args()
+
+    basis = BASES[args.basis]
+    n_max = args.n_min if args.n_max is None else args.n_max
+    error_budget = args.error_budget
+    if args.infidelity_budget is not None:
+        error_budget = norm_budget_for_infidelity(args.infidelity_budget)
+
+    for n in range(args.n_min, n_max + 1):
+        if args.check:
+            estimated, measured = check_resource_estimate(n, basis=basis, error_budget=error_budget,
+                                                          depth_vs_cx=args.depth_vs_cx)
+            status = 'ok' if all(estimated[key] == measured[key] for key in ('cx', 'total', 'depth')) else 'MISMATCH'
+            print(n, estimated['cx'], estimated['total'], estimated['depth'],
+                  measured['cx'], measured['total'], measured['depth'], status)
+        elif error_budget > 0:
+            exact = estimate_resources(n, basis=basis, depth=not args.no_depth, depth_vs_cx=args.depth_vs_cx)
+            resources = estimate_resources(n, basis=basis, depth=not args.no_depth, error_budget=error_budget,
+                                           depth_vs_cx=args.depth_vs_cx)
+            print(n, exact['cx'], resources['cx'], exact['total'], resources['total'],
+                  exact.get('depth', ''), resources.get('depth', ''),
+                  '%.3g' % resources['error_bound'], '%.3g' % infidelity_bound(resources['error_bound']))
+        else:
+            resources = estimate_resources(n, basis=basis, depth=not args.no_depth, depth_vs_cx=args.depth_vs_cx)
+            print(n, resources['cx'], resources['total'], resources.get('depth', ''))
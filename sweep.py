@@ -0,0 +1,166 @@
+import argparse
+import csv
+import json
+import os
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from gate_stream import BASES, GateStream
+from n_toffoli_decomp_utils import QULIN_THETA, ccz_qulin_combined, ccz_qulin, ccz_smallqulin
+from template_cache import clear_template_cache
+
+
+VARIANTS = ('combined', 'smallqulin', 'qulin')
+FIELDS = ('n', 'variant', 'basis', 'cx', 'total', 'depth', 'build_time', 'peak_memory', 'error')
+
+
+# This function builds the n-qubit Toffoli with one of the variants, as main.py does, or the CCZ with
+# toffoli=False, into a new GateStream lowered into the basis named basis (None or 'none' keeps the emitted
+# gates), or into the gate sink gates.
+def build_toffoli(n, variant='combined', basis=None, error_budget=0.0, depth_vs_cx='cx', gates=None, toffoli=True):
+    qubits = list(range(n))
+    if gates is None:
+        gates = GateStream(n, basis=None if basis is None else BASES[basis])
+
+    if toffoli:
+        gates.h(qubits[-1])
+    if variant == 'combined':
+        ccz_qulin_combined(gates, qubits, error_budget=error_budget, depth_vs_cx=depth_vs_cx)
+    elif variant == 'smallqulin':
+        ccz_smallqulin(qc=gates, operated_qubits=qubits, theta=QULIN_THETA, error_budget=error_budget,
+                       depth_vs_cx=depth_vs_cx)
+    else:
+        ccz_qulin(qc=gates, operated_qubits=qubits, theta=QULIN_THETA, error_budget=error_budget,
+                  depth_vs_cx=depth_vs_cx)
+    if toffoli:
+        gates.h(qubits[-1])
+    return gates
+
+
+# This function compiles one point of the sweep in a worker process and returns its row.
+# The build is timed without tracemalloc, which slows it down, and then repeated to measure the peak memory.
+def run_point(n, variant, basis, measure_memory=True):
+    row = {'n': n, 'variant': variant, 'basis': basis, 'error': ''}
+    try:
+        clear_template_cache()
+        start = time.perf_counter()
+        gates = build_toffoli(n, variant=variant, basis=basis)
+        row['build_time'] = time.perf_counter() - start
+
+        counts = gates.count_ops()
+        row['cx'] = counts.get('cx', 0)
+        row['total'] = len(gates)
+        row['depth'] = gates.depth()
+        del gates
+
+        row['peak_memory'] = ''
+        if measure_memory:
+            clear_template_cache()
+            tracemalloc.start()
+            build_toffoli(n, variant=variant, basis=basis)
+            row['peak_memory'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    except Exception as error:
+        row['error'] = '%s: %s' % (type(error).__name__, error)
+    return row
+
+
+def _is_jsonl(path):
+    return path.endswith('.jsonl')
+
+
+# This function returns the (n, variant, basis) points already written to path without error.
+def completed_points(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+
+    with open(path, newline='') as file:
+        if _is_jsonl(path):
+            rows = []
+            for line in file:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    continue
+        else:
+            rows = list(csv.DictReader(file))
+
+    for row in rows:
+        if any(row.get(field) is None for field in FIELDS) or row['error']:
+            continue
+        done.add((int(row['n']), row['variant'], row['basis']))
+    return done
+
+
+# This class appends rows to a CSV or JSONL file as they arrive, so a crashed sweep keeps its results.
+class RowWriter:
+    def __init__(self, path):
+        self.path = path
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new_file:
+            with open(path, 'rb') as file:
+                file.seek(-1, os.SEEK_END)
+                ends_with_newline = file.read(1) == b'\n'
+
+        self.file = open(path, 'a', newline='')
+        if not new_file and not ends_with_newline:
+            self.file.write('\n')
+        self.csv_writer = None
+        if not _is_jsonl(path):
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+            if new_file:
+                self.csv_writer.writeheader()
+
+    def write(self, row):
+        if self.csv_writer is None:
+            self.file.write(json.dumps(row) + '\n')
+        else:
+            self.csv_writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# This function runs every (n, variant, basis) point not yet in output over a process pool.
+# With verbose=True every row is also printed as it finishes.
+def run_sweep(n_values, variants, bases, output, jobs=None, measure_memory=True, resume=True, verbose=False):
+    done = completed_points(output) if resume else set()
+    points = [(n, variant, basis) for n in n_values for variant in variants for basis in bases
+              if (n, variant, basis) not in done]
+
+    # The largest circuits are submitted first so that they do not end up last on a single worker.
+    points.sort(key=lambda point: -point[0])
+
+    writer = RowWriter(output)
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(run_point, n, variant, basis, measure_memory) for n, variant, basis in points]
+            for future in as_completed(futures):
+                row = future.result()
+                writer.write(row)
+                if verbose:
+                    print(row['n'], row['variant'], row['basis'], row.get('cx', ''), row.get('total', ''),
+                          row.get('depth', ''), row['error'])
+    finally:
+        writer.close()
+    return len(points)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweep the Qulin compilation over a range of n.')
+    parser.add_argument('n_min', type=int)
+    parser.add_argument('n_max', type=int)
+    parser.add_argument('--step', type=int, default=1)
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=['combined'])
+    parser.add_argument('--bases', nargs='+', choices=list(BASES), default=['ibm'])
+    parser.add_argument('--output', default='sweep.csv', help='a .csv or .jsonl file, appended to')
+    parser.add_argument('--jobs', type=int, default=None, help='number of worker processes (default: all cores)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced build that measures peak memory')
+    parser.add_argument('--no-resume', action='store_true', help='also rerun the points already in the output')
+    args = parser.parse_args()
+
+    run_sweep(range(args.n_min, args.n_max + 1, args.step), args.variants, args.bases, args.output,
+              jobs=args.jobs, measure_memory=not args.no_memory, resume=not args.no_resume, verbose=True)
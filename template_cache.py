@@ -0,0 +1,143 @@
+import contextlib
+import functools
+import inspect
+from collections import OrderedDict
+
+import numpy as np
+
+from gate_stream import GateStream
+
+
+_templates = OrderedDict()
+_max_size = 256
+_max_bytes = 64 << 20
+_stats = {'hits': 0, 'misses': 0, 'bytes': 0}
+_bypass = 0
+
+
+def _template_bytes(template):
+    return template._ops.nbytes + template._qubits.nbytes + template._params.nbytes
+
+
+# This function evicts the least recently used templates until the cache fits both bounds.
+def _evict():
+    while _templates and (len(_templates) > _max_size or _stats['bytes'] > _max_bytes):
+        _, template = _templates.popitem(last=False)
+        _stats['bytes'] -= _template_bytes(template)
+
+
+# This function adds a template to the cache, stored compactly, and returns the stored one.
+def _store(key, template):
+    template = GateStream.from_arrays(template.ops, template.qubits, template.params,
+                                      num_qubits=template.num_qubits, global_phase=template.global_phase,
+                                      basis=template.basis)
+    old = _templates.pop(key, None)
+    if old is not None:
+        _stats['bytes'] -= _template_bytes(old)
+    _templates[key] = template
+    _stats['bytes'] += _template_bytes(template)
+    _evict()
+    return template
+
+
+# This function sets the maximum number of templates and, if given, of bytes kept in the cache, evicting the
+# least recently used templates.
+def set_template_cache_size(max_size, max_bytes=None):
+    global _max_size, _max_bytes
+    _max_size = max_size
+    if max_bytes is not None:
+        _max_bytes = max_bytes
+    _evict()
+
+
+# This context manager makes cached functions run their body instead of using the cache, which is left as it
+# is: nothing is looked up, stored or evicted while it is active.
+@contextlib.contextmanager
+def bypass_template_cache():
+    global _bypass
+    _bypass += 1
+    try:
+        yield
+    finally:
+        _bypass -= 1
+
+
+def clear_template_cache():
+    _templates.clear()
+    _stats['hits'] = 0
+    _stats['misses'] = 0
+    _stats['bytes'] = 0
+
+
+def template_cache_info():
+    return {'hits': _stats['hits'], 'misses': _stats['misses'], 'size': len(_templates), 'max_size': _max_size,
+            'bytes': _stats['bytes'], 'max_bytes': _max_bytes}
+
+
+# This function returns the cache key of a call of a cached function (arguments maps the argument names
+# to their values, without qc) and the qubit-list arguments the template is built on.
+def template_key(function, basis, arguments):
+    qubit_lists = []
+    key = [function.__qualname__, basis]
+    for name, value in arguments.items():
+        if name == 'qc':
+            continue
+        if isinstance(value, list):
+            qubit_lists.append((name, value))
+            key.append((name, len(value)))
+        else:
+            key.append((name, value))
+    return tuple(key), qubit_lists
+
+
+# This function builds the template of a call of a cached function, on qubits 0, 1, ... in the order of its
+# qubit-list arguments, and returns its key and the template without adding it to the cache.
+def build_template(function, basis, arguments):
+    key, qubit_lists = template_key(function, basis, arguments)
+    local_arguments = dict(arguments)
+    offset = 0
+    for name, value in qubit_lists:
+        local_arguments[name] = list(range(offset, offset + len(value)))
+        offset += len(value)
+    template = GateStream(offset, basis=basis)
+    local_arguments['qc'] = template
+    getattr(function, '__wrapped__', function)(**local_arguments)
+    return key, template
+
+
+# This decorator memoizes a decomposition function as a template on relative qubit indices.
+# The template is keyed on the function, the length of every qubit-list argument and the other arguments,
+# and the target basis, and is instantiated by remapping its qubits onto the actual ones.
+# Only GateStream sinks use the cache, which is bounded both in templates and in bytes. Functions called once
+# per build, such as the top-level ccz_qulin, are not worth caching: their template would be a second copy of
+# the circuit.
+def cached_template(function):
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(qc, *args, **kwargs):
+        # Sinks that only follow the circuit, such as resource_estimator.DepthSink, take the call as a whole.
+        apply_template = getattr(qc, 'apply_template', None)
+        if apply_template is not None:
+            return apply_template(function, signature.bind(qc, *args, **kwargs).arguments)
+
+        if not isinstance(qc, GateStream) or _max_size <= 0 or _bypass:
+            return function(qc, *args, **kwargs)
+
+        arguments = signature.bind(qc, *args, **kwargs).arguments
+        key, qubit_lists = template_key(function, qc.basis, arguments)
+
+        template = _templates.get(key)
+        if template is None:
+            _stats['misses'] += 1
+            _, template = build_template(function, qc.basis, arguments)
+            template = _store(key, template)
+        else:
+            _stats['hits'] += 1
+            _templates.move_to_end(key)
+
+        qubit_map = np.fromiter((qubit for _, value in qubit_lists for qubit in value), dtype=np.int32,
+                                count=template.num_qubits)
+        qc.extend(template, qubit_map=qubit_map)
+
+    return wrapper